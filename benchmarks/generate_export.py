@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+"""Synthetic vracoop exports and matching drive spreadsheets.
+
+generate_xls writes the BIFF xls exports of production (xlwt), up to
+XLS_MAX_ROWS products. generate_export writes the same products as xlsx
+(XlsxWriter) and generate_csv as csv, for any number of rows.
+"""
+import csv
+import io
+import random
+
+from argparse import ArgumentParser
+
+import xlsxwriter
+import xlwt
+
+EXPORT_TITLES = [
+    "id",
+    "name",
+    "qty_available",
+    "list_price",
+    "by_unit",
+    "taxes_id",
+    "categ_id",
+    "barcode",
+]
+DRIVE_TITLES = ["ID", "Nom", "Stock", "Prix", "Prix au kg/l", "Conditionnement", "TVA"]
+ERRORS_TITLES = ["IDs manquants"]
+
+STOCK_CONFIG = {
+    "ID_title": "id",
+    "name_title": "name",
+    "stock_title": "qty_available",
+    "price_title": "list_price",
+    "by_unit_title": "by_unit",
+    "TVA_title": "taxes_id",
+}
+DRIVE_CONFIG = {
+    "sheetId": "benchmark",
+    "sheetLabel": "Stock",
+    "ID_title": "ID",
+    "name_title": "Nom",
+    "stock_title": "Stock",
+    "price_title": "Prix",
+    "quantity_price_title": "Prix au kg/l",
+    "cond_title": "Conditionnement",
+    "TVA_title": "TVA",
+    "errors_sheet": "Erreurs",
+    "missing_UGS_title": "IDs manquants",
+}
+
+# rows of a BIFF sheet, title row included
+XLS_MAX_ROWS = 65535
+
+TVA_CODES = [
+    "__export__.account_tax_4",
+    "__export__.account_tax_2",
+    "__export__.account_tax_9",
+]
+CONDITIONINGS = ["250g", "500g", "1000g", " 750ml sachet", "1000ml", "pièce", ""]
+CATEGORIES = ["Epicerie", "Fruits secs", "Liquides", "Hygiène", "Céréales"]
+
+
+def product_ids(rows: int) -> list:
+    return [str(1000 + i) for i in range(rows)]
+
+
+def export_lines(rows: int, *, seed: int = 0):
+    """Lines of `rows` products, about 2% of which are junk rows (empty,
+    without ID, numeric IDs or text quantities).
+    """
+    rnd = random.Random(seed)
+    for product_id in product_ids(rows):
+        by_unit = rnd.random() < 0.3
+        line = [
+            f"__export__.product_template_{product_id}",
+            f"Produit {product_id}",
+            rnd.randint(0, 50) if by_unit else round(rnd.uniform(0, 25), 3),
+            round(rnd.uniform(0.5, 40), 2),
+            # the export flag is 0 for products sold by unit
+            0.0 if by_unit else 1.0,
+            rnd.choice(TVA_CODES),
+            rnd.choice(CATEGORIES),
+            str(rnd.randint(10 ** 12, 10 ** 13 - 1)),
+        ]
+        junk = rnd.random()
+        if junk < 0.005:
+            line = [""] * len(line)
+        elif junk < 0.01:
+            line[0] = ""
+        elif junk < 0.015:
+            line[0] = rnd.randint(1, 99)
+        elif junk < 0.02:
+            line[2] = "N/A"
+        yield line
+
+
+def generate_export(rows: int, *, seed: int = 0) -> bytes:
+    """xlsx export of `rows` products, see export_lines."""
+    output = io.BytesIO()
+    workbook = xlsxwriter.Workbook(output, {"in_memory": True})
+    sheet = workbook.add_worksheet("Export")
+    sheet.write_row(0, 0, EXPORT_TITLES)
+    for row, line in enumerate(export_lines(rows, seed=seed), start=1):
+        sheet.write_row(row, 0, line)
+    workbook.close()
+    return output.getvalue()
+
+
+def generate_xls(rows: int, *, seed: int = 0) -> bytes:
+    """xls export of the products of generate_export, at most XLS_MAX_ROWS."""
+    if rows > XLS_MAX_ROWS:
+        raise ValueError(f"xls exports hold at most {XLS_MAX_ROWS} products")
+    workbook = xlwt.Workbook()
+    sheet = workbook.add_sheet("Export")
+    for col, title in enumerate(EXPORT_TITLES):
+        sheet.write(0, col, title)
+    for row, line in enumerate(export_lines(rows, seed=seed), start=1):
+        for col, value in enumerate(line):
+            if value != "":
+                sheet.write(row, col, value)
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+
+def generate_csv(rows: int, *, seed: int = 0) -> bytes:
+    """csv export of the products of generate_export."""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(EXPORT_TITLES)
+    writer.writerows(export_lines(rows, seed=seed))
+    return output.getvalue().encode("utf-8")
+
+
+def generate_drive(rows: int, *, seed: int = 0) -> list:
+    """Drive spreadsheet rows matching generate_export: about 5% of the
+    exported products are missing and some extra IDs are added.
+    """
+    rnd = random.Random(seed + 1)
+    grid = [DRIVE_TITLES]
+    ids = [pid for pid in product_ids(rows) if rnd.random() > 0.05]
+    ids += [str(900000 + i) for i in range(max(rows // 100, 1))]
+    rnd.shuffle(ids)
+    for product_id in ids:
+        name = f"Produit {product_id}"
+        if rnd.random() < 0.02:
+            name = name.upper()
+        grid.append([product_id, name, "", "", "", rnd.choice(CONDITIONINGS), ""])
+    return grid
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("rows", type=int, help="Number of products")
+    parser.add_argument("output", help="Path to the generated export")
+    parser.add_argument("--seed", type=int, default=0)
+    export_format = parser.add_mutually_exclusive_group()
+    export_format.add_argument("--csv", action="store_true", help="Write a csv export")
+    export_format.add_argument("--xls", action="store_true", help="Write an xls export")
+    args = parser.parse_args()
+    generate = generate_export
+    if args.csv:
+        generate = generate_csv
+    elif args.xls:
+        generate = generate_xls
+    with open(args.output, "wb") as f:
+        f.write(generate(args.rows, seed=args.seed))
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""Startup time of the `stock` command line.
+
+Each command runs in a fresh interpreter; `import stock_syncer` is what
+every command paid before the subcommands imported it lazily:
+
+    ./benchmarks/import_time.py --repeat 10
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from argparse import ArgumentParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = {
+    "python": [sys.executable, "-c", "pass"],
+    "stock --help": [sys.executable, "stock", "--help"],
+    "stock sync --help": [sys.executable, "stock", "sync", "--help"],
+    "import stock_syncer": [sys.executable, "-c", "import stock_syncer"],
+}
+
+
+def measure(command: list, repeat: int) -> list:
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, check=True)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def main(args):
+    for name, command in COMMANDS.items():
+        durations = measure(command, args.repeat)
+        print(
+            f"{name:<22} median {statistics.median(durations) * 1000:7.1f} ms"
+            f"  min {min(durations) * 1000:7.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    main(parser.parse_args())
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+"""Time the main stages of the syncers against the Sheets emulator.
+
+Results are stored as JSON, pass a previous result with --compare to
+spot regressions:
+
+    ./benchmarks/run_benchmarks.py --rows 1000 10000 --output after.json \
+        --compare before.json
+"""
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from argparse import ArgumentParser
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import stock_cache
+import stock_syncer
+from generate_export import (
+    DRIVE_CONFIG,
+    ERRORS_TITLES,
+    STOCK_CONFIG,
+    XLS_MAX_ROWS,
+    generate_csv,
+    generate_drive,
+    generate_export,
+    generate_xls,
+)
+from sheets_emulator import SheetsEmulator
+from stock_syncer import (
+    FORMULA_STRATEGIES,
+    StockCheckerID,
+    StockSyncer,
+    col_to_a1,
+    rowcol_to_a1,
+)
+
+# medians slower than the compared ones by this ratio are reported
+REGRESSION_RATIO = 1.2
+
+
+def timed(timings: dict, stage: str, func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    timings.setdefault(stage, []).append(time.perf_counter() - start)
+    return result
+
+
+def new_emulator(rows: int, latency: float) -> SheetsEmulator:
+    emulator = SheetsEmulator(latency=latency)
+    emulator.add_sheet(
+        DRIVE_CONFIG["sheetId"], DRIVE_CONFIG["sheetLabel"], generate_drive(rows)
+    )
+    emulator.add_sheet(
+        DRIVE_CONFIG["sheetId"], DRIVE_CONFIG["errors_sheet"], [ERRORS_TITLES]
+    )
+    return emulator
+
+
+def bench_sync(
+    timings: dict, xls_data: bytes, emulator: SheetsEmulator, drive: dict
+) -> dict:
+    phases = []
+
+    def progress(name):
+        phases.append((name, time.perf_counter()))
+
+    syncer = StockSyncer(
+        drive=drive,
+        stock=STOCK_CONFIG,
+        credentials=None,
+        service=emulator,
+        progress=progress,
+    )
+    result = timed(timings, "sync", syncer.sync, xls_data)
+    phases.append((None, time.perf_counter()))
+    for (name, start), (_, end) in zip(phases, phases[1:]):
+        timings.setdefault(f"sync.{name}", []).append(end - start)
+    timed(timings, "update_error", syncer.update_error, result=result)
+    return result
+
+
+def bench_checks(timings: dict, xls_data: bytes, emulator: SheetsEmulator):
+    checker = StockCheckerID(
+        drive=DRIVE_CONFIG, stock=STOCK_CONFIG, credentials=None, service=emulator
+    )
+    timed(timings, "check", checker.check, xls_data)
+    checker = StockCheckerID(
+        drive=DRIVE_CONFIG, stock=STOCK_CONFIG, credentials=None, service=emulator
+    )
+    timed(timings, "extra", checker.extra, xls_data)
+
+
+def bench_a1(timings: dict, rows: int):
+    def addresses():
+        for col in range(4):
+            for row in range(rows):
+                rowcol_to_a1(row, col, sheetLabel=DRIVE_CONFIG["sheetLabel"])
+
+    def labels():
+        for _ in range(max(rows // 702, 1)):
+            for col in range(702):
+                col_to_a1(col)
+
+    timed(timings, "rowcol_to_a1", addresses)
+    timed(timings, "col_to_a1", labels)
+
+
+def run(rows: int, *, repeat: int, latency: float, strategy: str) -> dict:
+    exports = {"xlsx": generate_export(rows), "csv": generate_csv(rows)}
+    # syncs and checks read the xls exports of production, xlsx ones past
+    # the size limit of xls
+    export_format = "xlsx"
+    if rows <= XLS_MAX_ROWS:
+        exports["xls"] = generate_xls(rows)
+        export_format = "xls"
+    xls_data = exports[export_format]
+    emulator = new_emulator(rows, latency)
+    titles = [
+        STOCK_CONFIG[key]
+        for key in ["ID_title", "stock_title", "price_title", "name_title"]
+    ]
+    drive = dict(DRIVE_CONFIG, formula_strategy=strategy)
+    timings = {}
+    for _ in range(repeat):
+        for name, data in exports.items():
+            timed(timings, f"parse.{name}", stock_syncer.read_stock, data, titles)
+        bench_sync(timings, xls_data, emulator, drive)
+        bench_checks(timings, xls_data, emulator)
+        bench_a1(timings, rows)
+    stages = {}
+    for stage, values in timings.items():
+        stages[stage] = {
+            "min": min(values),
+            "median": statistics.median(values),
+            "mean": statistics.mean(values),
+        }
+    return {
+        "rows": rows,
+        "export_format": export_format,
+        "export_bytes": len(xls_data),
+        "api": emulator.stats(),
+        "stages": stages,
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(current: dict, previous: dict):
+    previous_runs = {run["rows"]: run for run in previous["runs"]}
+    print(f"Compared with {previous['revision']} ({previous['date']})")
+    for run in current["runs"]:
+        before = previous_runs.get(run["rows"])
+        if before is None:
+            continue
+        for stage, values in run["stages"].items():
+            if stage not in before["stages"]:
+                continue
+            ratio = values["median"] / before["stages"][stage]["median"]
+            flag = " REGRESSION" if ratio > REGRESSION_RATIO else ""
+            print(f"{run['rows']:>8} {stage:<16} x{ratio:.2f}{flag}")
+
+
+def main(args):
+    # measure parsing, not the export cache
+    stock_cache.EXPORT_CACHE_SIZE = 0
+    result = {
+        "revision": git_revision(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "repeat": args.repeat,
+        "latency": args.latency,
+        "formula_strategy": args.formula_strategy,
+        "runs": [],
+    }
+    for rows in args.rows:
+        run_result = run(
+            rows,
+            repeat=args.repeat,
+            latency=args.latency,
+            strategy=args.formula_strategy,
+        )
+        result["runs"].append(run_result)
+        for stage, values in run_result["stages"].items():
+            print(f"{rows:>8} {stage:<16} {values['median'] * 1000:10.1f} ms")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--rows", type=int, nargs="+", default=[1000, 10000, 100000],
+        help="Export sizes (default: %(default)s)",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Emulated API latency (seconds)"
+    )
+    parser.add_argument(
+        "--formula-strategy", choices=FORMULA_STRATEGIES, default="formula"
+    )
+    parser.add_argument("--output", help="Path to the JSON result file")
+    parser.add_argument("--compare", help="Path to a previous JSON result file")
+    args = parser.parse_args()
+    logging.getLogger("syncer").setLevel(logging.CRITICAL)
+    main(args)
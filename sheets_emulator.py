@@ -0,0 +1,389 @@
+"""In-process stand-in for the Google Sheets v4 API.
+
+SheetsEmulator implements the subset of the API used by DriveDocument
+(values.get, values.batchGet, values.batchUpdate, values.clear,
+spreadsheets.get and Drive files.get for the revision probe) over an
+in-memory grid, so that syncs can be exercised and benchmarked without
+network:
+
+    emulator = SheetsEmulator(latency=0.3)
+    emulator.add_sheet("sheetId", "Stock", [["ID", "Stock"], ["12", 3]])
+    syncer = StockSyncer(drive=drive, stock=stock, credentials=None,
+                         service=emulator)
+
+Formulas are stored but not evaluated: their text is returned whatever
+the value render option.
+"""
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+A1_RE = re.compile(r"^([A-Z]*)([0-9]*)$")
+
+DEFAULT_ROWS = 1000
+DEFAULT_COLUMNS = 26
+
+
+def a1_to_col(label: str) -> int:
+    """Column index (from 0) of an A1 column label."""
+    col = 0
+    for char in label:
+        col = col * 26 + ord(char) - ord("A") + 1
+    return col - 1
+
+
+def col_to_label(col: int) -> str:
+    label = ""
+    col = col + 1
+    while col:
+        col, mod = divmod(col - 1, 26)
+        label = chr(mod + ord("A")) + label
+    return label
+
+
+def parse_a1(arange: str):
+    """Split an A1 range in (sheet, first row, first col, last row, last col).
+    Indexes start at 0, unbounded limits are None.
+    >>> parse_a1("Stock!B2:C")
+    ('Stock', 1, 1, None, 2)
+    """
+    if "!" in arange:
+        sheet, cells = arange.rsplit("!", 1)
+    else:
+        sheet, cells = arange, ""
+    sheet = sheet.strip("'")
+    if cells == "":
+        return sheet, 0, 0, None, None
+    parts = cells.split(":")
+    start = A1_RE.match(parts[0])
+    end = A1_RE.match(parts[-1])
+    if start is None or end is None:
+        raise ValueError(f"Unable to parse range: {arange}")
+
+    def index(match, kind):
+        col, row = match.groups()
+        if kind == "row":
+            return int(row) - 1 if row else None
+        return a1_to_col(col) if col else None
+
+    r0 = index(start, "row")
+    c0 = index(start, "col")
+    r1 = index(end, "row")
+    c1 = index(end, "col")
+    return sheet, r0 or 0, c0 or 0, r1, c1
+
+
+def _format(value):
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _user_entered(value):
+    if isinstance(value, str) and not value.startswith("="):
+        try:
+            number = float(value.replace(",", "."))
+        except ValueError:
+            return value
+        return int(number) if number.is_integer() else number
+    return value
+
+
+class Request(object):
+    def __init__(self, emulator, method, request, handler):
+        self.emulator = emulator
+        self.method = method
+        self.request = request
+        self.handler = handler
+        # like googleapiclient HttpRequest
+        self.uri = f"emulator://{method}"
+        self.body = json.dumps(request, default=str)
+
+    def execute(self, http=None, num_retries=0):
+        return self.emulator._call(self.method, self.request, self.handler)
+
+
+class Sheet(object):
+    def __init__(self, sheetId: int, title: str, rows: list):
+        self.sheetId = sheetId
+        self.title = title
+        self.cells = {}
+        self.rowCount = DEFAULT_ROWS
+        self.columnCount = DEFAULT_COLUMNS
+        for row, values in enumerate(rows):
+            for col, value in enumerate(values):
+                self.set(row, col, value)
+
+    def set(self, row: int, col: int, value):
+        if value is None or value == "":
+            self.cells.pop((row, col), None)
+            return
+        self.cells[(row, col)] = value
+        self.rowCount = max(self.rowCount, row + 1)
+        self.columnCount = max(self.columnCount, col + 1)
+
+    def read(self, r0, c0, r1, c1, render, major="ROWS") -> list:
+        if r1 is None:
+            r1 = max([row for row, _ in self.cells] + [-1])
+        if c1 is None:
+            c1 = max([col for _, col in self.cells] + [-1])
+        outer, inner = (range(r0, r1 + 1), range(c0, c1 + 1))
+        if major == "COLUMNS":
+            outer, inner = inner, outer
+        values = []
+        for i in outer:
+            line = []
+            for j in inner:
+                cell = (i, j) if major == "ROWS" else (j, i)
+                value = self.cells.get(cell, "")
+                if render == "FORMATTED_VALUE" and value != "":
+                    value = _format(value)
+                line.append(value)
+            while line and line[-1] == "":
+                line.pop()
+            values.append(line)
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+
+class SheetsEmulator(object):
+    """Emulated Sheets service.
+    `latency` seconds are spent in every call. Every call fails with a
+    429 error with probability `quota_errors`, or on every
+    `quota_every`th call when set.
+    """
+
+    def __init__(self, *, latency=0.0, quota_errors=0.0, quota_every=None, seed=None):
+        self.latency = latency
+        self.quota_errors = quota_errors
+        self.quota_every = quota_every
+        self.spreadsheets_data = {}
+        self.versions = Counter()
+        self.calls = Counter()
+        self.errors = Counter()
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+
+    # setup and inspection
+
+    def add_sheet(self, spreadsheetId: str, title: str, rows: list = ()) -> Sheet:
+        with self._lock:
+            sheets = self.spreadsheets_data.setdefault(spreadsheetId, {})
+            sheet = Sheet(len(sheets), title, rows)
+            sheets[title] = sheet
+            return sheet
+
+    def sheet(self, spreadsheetId: str, title: str) -> Sheet:
+        try:
+            return self.spreadsheets_data[spreadsheetId][title]
+        except KeyError:
+            raise self._error(400, f"Unable to parse range: {title}")
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls.clear()
+            self.errors.clear()
+            self.request_bytes = 0
+            self.response_bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "calls": dict(self.calls),
+            "errors": dict(self.errors),
+            "request_bytes": self.request_bytes,
+            "response_bytes": self.response_bytes,
+        }
+
+    # service interface
+
+    def spreadsheets(self):
+        return _Spreadsheets(self)
+
+    def files(self):
+        return _Files(self)
+
+    # internals
+
+    @staticmethod
+    def _error(status: int, message: str) -> HttpError:
+        resp = httplib2.Response({"status": status})
+        resp.reason = message
+        content = json.dumps({"error": {"code": status, "message": message}})
+        return HttpError(resp, content.encode("utf-8"))
+
+    def _call(self, method: str, request: dict, handler):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls[method] += 1
+            self.request_bytes += len(json.dumps(request, default=str))
+            quota = self.quota_every is not None and (
+                sum(self.calls.values()) % self.quota_every == 0
+            )
+            if quota or self._random.random() < self.quota_errors:
+                self.errors[method] += 1
+                error = self._error(429, "Quota exceeded")
+                error.resp["retry-after"] = "0"
+                raise error
+            response = handler()
+            self.response_bytes += len(json.dumps(response, default=str))
+            return response
+
+    def _read(self, spreadsheetId, arange, render, major="ROWS") -> dict:
+        sheet, r0, c0, r1, c1 = parse_a1(arange)
+        values = self.sheet(spreadsheetId, sheet).read(r0, c0, r1, c1, render, major)
+        response = {"range": arange, "majorDimension": major}
+        if values:
+            response["values"] = values
+        return response
+
+    def _write(self, spreadsheetId, value_range: dict, input_option) -> dict:
+        arange = value_range["range"]
+        sheet_name, r0, c0, _, _ = parse_a1(arange)
+        sheet = self.sheet(spreadsheetId, sheet_name)
+        major = value_range.get("majorDimension", "ROWS")
+        cells = 0
+        rows = set()
+        cols = set()
+        for i, line in enumerate(value_range.get("values", [])):
+            for j, value in enumerate(line):
+                row, col = (r0 + i, c0 + j) if major == "ROWS" else (r0 + j, c0 + i)
+                if input_option == "USER_ENTERED":
+                    value = _user_entered(value)
+                sheet.set(row, col, value)
+                cells += 1
+                rows.add(row)
+                cols.add(col)
+        self.versions[spreadsheetId] += 1
+        return {
+            "spreadsheetId": spreadsheetId,
+            "updatedRange": arange,
+            "updatedRows": len(rows),
+            "updatedColumns": len(cols),
+            "updatedCells": cells,
+        }
+
+
+class _Values(object):
+    def __init__(self, emulator):
+        self.emulator = emulator
+
+    def get(self, spreadsheetId, range, valueRenderOption="FORMATTED_VALUE",
+            majorDimension="ROWS", **kwargs):
+        request = {"spreadsheetId": spreadsheetId, "range": range}
+        return Request(
+            self.emulator, "values.get", request,
+            lambda: self.emulator._read(
+                spreadsheetId, range, valueRenderOption, majorDimension
+            ),
+        )
+
+    def batchGet(self, spreadsheetId, ranges, valueRenderOption="FORMATTED_VALUE",
+                 majorDimension="ROWS", **kwargs):
+        request = {"spreadsheetId": spreadsheetId, "ranges": ranges}
+
+        def handler():
+            return {
+                "spreadsheetId": spreadsheetId,
+                "valueRanges": [
+                    self.emulator._read(
+                        spreadsheetId, arange, valueRenderOption, majorDimension
+                    )
+                    for arange in ranges
+                ],
+            }
+
+        return Request(self.emulator, "values.batchGet", request, handler)
+
+    def batchUpdate(self, spreadsheetId, body):
+        def handler():
+            responses = [
+                self.emulator._write(
+                    spreadsheetId, value_range, body.get("valueInputOption")
+                )
+                for value_range in body.get("data", [])
+            ]
+            return {
+                "spreadsheetId": spreadsheetId,
+                "totalUpdatedRows": sum(r["updatedRows"] for r in responses),
+                "totalUpdatedColumns": sum(r["updatedColumns"] for r in responses),
+                "totalUpdatedCells": sum(r["updatedCells"] for r in responses),
+                "totalUpdatedSheets": len(
+                    {r["updatedRange"].rsplit("!", 1)[0] for r in responses}
+                ),
+                "responses": responses,
+            }
+
+        return Request(self.emulator, "values.batchUpdate", body, handler)
+
+    def clear(self, spreadsheetId, range, body=None):
+        def handler():
+            sheet_name, r0, c0, r1, c1 = parse_a1(range)
+            sheet = self.emulator.sheet(spreadsheetId, sheet_name)
+            for row, col in list(sheet.cells):
+                if (
+                    r0 <= row
+                    and (r1 is None or row <= r1)
+                    and c0 <= col
+                    and (c1 is None or col <= c1)
+                ):
+                    del sheet.cells[(row, col)]
+            self.emulator.versions[spreadsheetId] += 1
+            return {"spreadsheetId": spreadsheetId, "clearedRange": range}
+
+        request = {"spreadsheetId": spreadsheetId, "range": range}
+        return Request(self.emulator, "values.clear", request, handler)
+
+
+class _Spreadsheets(object):
+    def __init__(self, emulator):
+        self.emulator = emulator
+
+    def values(self):
+        return _Values(self.emulator)
+
+    def get(self, spreadsheetId, fields=None, **kwargs):
+        def handler():
+            sheets = self.emulator.spreadsheets_data.get(spreadsheetId, {})
+            return {
+                "spreadsheetId": spreadsheetId,
+                "sheets": [
+                    {
+                        "properties": {
+                            "sheetId": sheet.sheetId,
+                            "title": sheet.title,
+                            "gridProperties": {
+                                "rowCount": sheet.rowCount,
+                                "columnCount": sheet.columnCount,
+                            },
+                        }
+                    }
+                    for sheet in sheets.values()
+                ],
+            }
+
+        request = {"spreadsheetId": spreadsheetId, "fields": fields}
+        return Request(self.emulator, "spreadsheets.get", request, handler)
+
+
+class _Files(object):
+    def __init__(self, emulator):
+        self.emulator = emulator
+
+    def get(self, fileId, fields=None, **kwargs):
+        def handler():
+            return {"version": str(self.emulator.versions[fileId] + 1)}
+
+        request = {"fileId": fileId, "fields": fields}
+        return Request(self.emulator, "files.get", request, handler)
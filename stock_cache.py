@@ -0,0 +1,279 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import logging
+
+logger = logging.getLogger("syncer")
+
+CACHE_DIR = os.getenv(
+    "STOCK_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "stock-sync")
+)
+# Seconds during which a probed spreadsheet revision is trusted
+SNAPSHOT_PROBE_TTL = 30
+# Size bound of the parsed exports cache, 0 disables it
+EXPORT_CACHE_SIZE = int(os.getenv("STOCK_EXPORT_CACHE_SIZE", 256 * 1024 * 1024))
+# Bytes read at a time when hashing export files
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def export_digest(source) -> str:
+    """SHA-256 of an export given as bytes, a path or a binary file.
+    Files are hashed by chunks, a file object is rewound to its position.
+    """
+    digest = hashlib.sha256()
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        digest.update(source)
+        return digest.hexdigest()
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+    position = source.tell()
+    source.seek(0)
+    try:
+        for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    finally:
+        source.seek(position)
+    return digest.hexdigest()
+
+
+class ExportCache(object):
+    """Parsed export columns stored as Arrow IPC (feather) files, one file
+    per column. Entries are keyed by the SHA-256 of the export and the
+    column title, so that the sync and the checks share the columns they
+    have in common. Titles missing from the export are remembered too.
+    The least recently used entries are evicted once the cache grows over
+    `max_bytes`.
+    """
+
+    SUFFIX = ".arrow"
+    # marker of a title missing from the export
+    ABSENT_SUFFIX = ".absent"
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(source) -> str:
+        return export_digest(source)
+
+    def _path(self, key: str, title: str, suffix: str) -> str:
+        column = hashlib.sha1(str(title).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{key}-{column[:16]}{suffix}")
+
+    def get(self, key: str, title: str):
+        """(True, values) of a cached column, values being None when the
+        export has no such column, (False, None) when not cached.
+        """
+        path = self._path(key, title, self.SUFFIX)
+        try:
+            frame = pd.read_feather(path)
+        except ImportError:
+            return False, None
+        except FileNotFoundError:
+            absent = self._path(key, title, self.ABSENT_SUFFIX)
+            if not os.path.exists(absent):
+                return False, None
+            path, frame = absent, None
+        # mtime tracks the last use for eviction
+        os.utime(path)
+        if frame is None:
+            return True, None
+        if "text" not in frame.columns:
+            return True, frame["number"].to_numpy(dtype=float)
+        # mixed column, see put
+        values = frame["number"].to_numpy(dtype=object)
+        text = frame["text"].notna().to_numpy()
+        values[text] = frame["text"].to_numpy(dtype=object)[text]
+        return True, values
+
+    def put(self, key: str, title: str, values):
+        """Store a column, `values` None records that the export has no
+        such column. Call evict once the columns are stored.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        if values is None:
+            with open(self._path(key, title, self.ABSENT_SUFFIX), "w"):
+                pass
+            return
+        values = np.asarray(values)
+        if values.dtype == object:
+            # columns mixing text and numbers are stored as two typed
+            # columns, booleans as numbers; other values (dates) as text
+            numeric = np.array(
+                [
+                    isinstance(value, (int, float, np.number, np.bool_))
+                    for value in values
+                ],
+                dtype=bool,
+            )
+            number = np.full(len(values), np.nan)
+            number[numeric] = values[numeric].astype(float)
+            text = np.full(len(values), None, dtype=object)
+            other = ~numeric & ~pd.isna(values)
+            text[other] = [str(value) for value in values[other]]
+            frame = pd.DataFrame({"number": number, "text": text})
+        else:
+            frame = pd.DataFrame({"number": values.astype(float)})
+        path = self._path(key, title, self.SUFFIX)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            frame.to_feather(tmp_path)
+        except ImportError:
+            logger.warning("pyarrow is not available, exports are not cached")
+            os.remove(tmp_path)
+            return
+        os.replace(tmp_path, path)
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith((self.SUFFIX, self.ABSENT_SUFFIX)):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            logger.debug(f"Evicting {path} from export cache")
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+_export_cache = None
+
+
+def export_cache():
+    """Process wide export cache, None when disabled."""
+    global _export_cache
+    if EXPORT_CACHE_SIZE <= 0:
+        return None
+    if _export_cache is None:
+        _export_cache = ExportCache(
+            os.path.join(CACHE_DIR, "exports"), EXPORT_CACHE_SIZE
+        )
+    return _export_cache
+
+
+class SheetSnapshotCache(object):
+    """Title rows and column values of spreadsheets, one JSON file per
+    spreadsheet. A snapshot is only valid for the drive revision it was
+    taken at.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, spreadsheetId: str) -> str:
+        return os.path.join(self.directory, f"{spreadsheetId}.json")
+
+    @staticmethod
+    def _column_key(key: tuple) -> str:
+        sheetLabel, column_name, formula = key
+        return f"{sheetLabel}\t{column_name}\t{int(formula)}"
+
+    def load(self, spreadsheetId: str, revision: str):
+        """Return (headers, columns) taken at `revision`, None otherwise."""
+        try:
+            with open(self._path(spreadsheetId), "r") as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if data.get("revision", None) != revision:
+            return None
+        columns = {}
+        for key, values in data["columns"].items():
+            sheetLabel, column_name, formula = key.split("\t")
+            columns[(sheetLabel, column_name, formula == "1")] = values
+        logger.debug(f"Snapshot of {spreadsheetId} loaded at revision {revision}")
+        return data["headers"], columns
+
+    def save(self, spreadsheetId: str, revision: str, headers: dict, columns: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        data = {
+            "revision": revision,
+            "headers": headers,
+            "columns": {
+                self._column_key(key): values for key, values in columns.items()
+            },
+        }
+        path = self._path(spreadsheetId)
+        # unique name, documents of several threads may save at once
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def invalidate(self, spreadsheetId: str):
+        try:
+            os.remove(self._path(spreadsheetId))
+        except FileNotFoundError:
+            pass
+
+
+def sheet_snapshots() -> SheetSnapshotCache:
+    return SheetSnapshotCache(os.path.join(CACHE_DIR, "sheets"))
+
+
+class SyncStateCache(object):
+    """State of the last export synced to each sheet, as Arrow IPC
+    (feather) files. States are keyed by the layout of the synced columns
+    too, so that moved columns start over with a full sync.
+    """
+
+    SUFFIX = ".arrow"
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, spreadsheetId: str, sheetLabel: str, layout: str) -> str:
+        key = hashlib.sha1(f"{sheetLabel}\0{layout}".encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{spreadsheetId}-{key[:16]}{self.SUFFIX}")
+
+    def load(self, spreadsheetId: str, sheetLabel: str, layout: str):
+        try:
+            return pd.read_feather(self._path(spreadsheetId, sheetLabel, layout))
+        except (FileNotFoundError, ImportError):
+            return None
+
+    def save(self, spreadsheetId: str, sheetLabel: str, layout: str, state):
+        """Replace the state atomically."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(spreadsheetId, sheetLabel, layout)
+        # unique name, syncers of several threads may save at once
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            state.reset_index(drop=True).to_feather(tmp_path)
+        except ImportError:
+            logger.warning("pyarrow is not available, no incremental sync")
+            os.remove(tmp_path)
+            return
+        os.replace(tmp_path, path)
+
+    def invalidate(self, spreadsheetId: str, sheetLabel: str, layout: str):
+        try:
+            os.remove(self._path(spreadsheetId, sheetLabel, layout))
+        except FileNotFoundError:
+            pass
+
+
+def sync_states() -> SyncStateCache:
+    return SyncStateCache(os.path.join(CACHE_DIR, "sync"))
@@ -0,0 +1,534 @@
+"""`stock` command line: sync, check-names, check-extra, images, report and
+watch subcommands.
+
+Only the standard library is imported at startup: pandas, the Google
+clients and the syncers are imported by the subcommands needing them, so
+that `--help` and argument errors answer at once.
+"""
+import os.path
+import pickle
+import sys
+import time
+import logging
+
+from argparse import ArgumentParser
+from configparser import ConfigParser
+
+from stock_watch import DEBOUNCE, FolderWatcher, error_path, is_export, report_path
+
+logger = logging.getLogger("syncer")
+
+# If modifying these scopes, delete the file token.pickle.
+SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/spreadsheets.readonly",
+    "https://www.googleapis.com/auth/drive.metadata.readonly",
+]
+
+
+def retrieve_credentials(token_path="token.pickle"):
+    from google.auth.transport.requests import Request
+
+    creds = None
+    if os.path.exists(token_path):
+        with open(token_path, "rb") as token:
+            creds = pickle.load(token)
+    # If there are no (valid) credentials available, let the user log in.
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            creds.refresh(Request())
+        else:
+            from google_auth_oauthlib.flow import InstalledAppFlow
+
+            flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
+            creds = flow.run_local_server(port=0)
+        # Save the credentials for the next run
+        with open(token_path, "wb") as token:
+            pickle.dump(creds, token)
+    return creds
+
+
+def _read_drive(parser: ConfigParser) -> dict:
+    drive = {}
+    drive["sheetId"] = parser.get("drive", "spreadsheet")
+    drive["sheetLabel"] = parser.get("drive", "sheet_label")
+    drive["snapshot"] = parser.getboolean("drive", "snapshot", fallback=False)
+    return drive
+
+
+def read_config(path, *, names=False):
+    """(drive, stock) settings of the sync, with the drive name column
+    when `names` (report)."""
+    parser = ConfigParser()
+    parser.read(path)
+    drive = _read_drive(parser)
+    stock = {}
+    drive["incremental"] = parser.getboolean("drive", "incremental", fallback=False)
+    drive["formula_strategy"] = parser.get(
+        "drive", "formula_strategy", fallback="formula"
+    )
+
+    for kk in ["ID_title", "stock_title", "price_title", "TVA_title"]:
+        drive[kk] = parser.get("drive", kk)
+        stock[kk] = parser.get("stock", kk)
+
+    stock["name_title"] = parser.get("stock", "name_title")
+    stock["by_unit_title"] = parser.get("stock", "by_unit_title")
+    if names is True:
+        drive["name_title"] = parser.get("drive", "name_title")
+
+    drive["quantity_price_title"] = parser.get("drive", "quantity_price_title")
+    drive["cond_title"] = parser.get("drive", "cond_title")
+
+    drive["errors_sheet"] = parser.get("drive", "errors_sheet_label")
+    drive["missing_UGS_title"] = parser.get("drive", "missing_UGS_title")
+    return drive, stock
+
+
+def read_check_config(path):
+    """(drive, stock) settings of the name and extra IDs checks."""
+    parser = ConfigParser()
+    parser.read(path)
+    drive = _read_drive(parser)
+    stock = {}
+    for kk in ["ID_title", "name_title"]:
+        drive[kk] = parser.get("drive", kk)
+        stock[kk] = parser.get("stock", kk)
+    return drive, stock
+
+
+def read_images_config(path):
+    parser = ConfigParser()
+    parser.read(path)
+    drive = _read_drive(parser)
+    for kk in ["ID_title", "images_title"]:
+        drive[kk] = parser.get("drive", kk)
+    return drive, {}
+
+
+def _write_sheets(path, sheets: dict):
+    """Write {sheet name: {column title: values}} as an xlsx file."""
+    import pandas as pd
+
+    # Create a Pandas Excel writer using XlsxWriter as the engine.
+    writer = pd.ExcelWriter(path, engine="xlsxwriter")
+    for sheet_name, columns in sheets.items():
+        pd.DataFrame(columns).to_excel(writer, sheet_name=sheet_name, index=False)
+    # Close the Pandas Excel writer and output the Excel file.
+    writer.save()
+
+
+def _missing_ids(result) -> dict:
+    return {
+        "ID": [elem["id"] for elem in result["missing_ids"]],
+        "Name": [elem["name"] for elem in result["missing_ids"]],
+    }
+
+
+def _names(result) -> dict:
+    return {
+        "ID": [elem["id"] for elem in result["names"]],
+        "Nom vracoop": [elem["vrac_name"] for elem in result["names"]],
+        "Nom drive": [elem["drive_name"] for elem in result["names"]],
+    }
+
+
+def _extra(result) -> dict:
+    return {
+        "ID": [elem["id"] for elem in result["extra"]],
+        "Ligne drive": [elem["row"] for elem in result["extra"]],
+    }
+
+
+def _duplicates(result) -> dict:
+    duplicates = [
+        (origin, elem)
+        for origin, values in result["duplicates"].items()
+        for elem in values
+    ]
+    return {
+        "ID": [elem["id"] for _, elem in duplicates],
+        "Origine": [origin for origin, _ in duplicates],
+        "Lignes": [
+            ", ".join(str(row) for row in elem["rows"]) for _, elem in duplicates
+        ],
+    }
+
+
+def write_report(path, results: dict):
+    """Missing IDs of each {sheet name: sync result}."""
+    _write_sheets(
+        path,
+        {sheet_name: _missing_ids(result) for sheet_name, result in results.items()},
+    )
+
+
+def cmd_sync(args, creds):
+    from stock_syncer import StockFanOut, StockSyncer, format_stats
+
+    configs = [read_config(path) for path in args.config or ["config.ini"]]
+    if len(configs) > 1:
+        drives = [drive for drive, _ in configs]
+        stock = configs[0][1]
+        if any(other != stock for _, other in configs):
+            raise ValueError("[stock] sections of the configurations differ")
+        fanout = StockFanOut(drives=drives, stock=stock, credentials=creds)
+        result = fanout.sync(args.stock, dry=args.dry, diff=args.diff, full=args.full)
+        failed = 0
+        for path, target in zip(args.config, result["targets"]):
+            if target["status"] != "done":
+                failed += 1
+                print(f"{path}: failed: {target['error']}")
+                continue
+            print(
+                f"{path}: {len(target['result']['missing_ids'])} missing IDs, "
+                f"spreadsheet URL: {target['errors']['url']}"
+            )
+            if args.stats:
+                print(format_stats(target["result"]["stats"]))
+        if args.output:
+            write_report(
+                args.output,
+                {
+                    f"IDs manquants {i + 1}": target["result"]
+                    for i, target in enumerate(result["targets"])
+                    if target["status"] == "done"
+                },
+            )
+        return 1 if failed > 0 else 0
+
+    drive, stock = configs[0]
+    stockSyncer = StockSyncer(drive=drive, stock=stock, credentials=creds)
+    result = stockSyncer.sync(args.stock, dry=args.dry, diff=args.diff, full=args.full)
+    for elem in result["missing_ids"]:
+        print(f"{elem['id']}, {elem['name']}")
+    if args.output:
+        write_report(args.output, {"IDs manquants": result})
+    # update drive
+    update_res = stockSyncer.update_error(result=result)
+    print(f"Spreadsheet URL: {update_res['url']}")
+    if args.stats:
+        print(format_stats(result["stats"]))
+        print(format_stats(update_res["stats"]))
+    return 0
+
+
+def cmd_check_names(args, creds):
+    from stock_syncer import StockCheckerID, format_stats
+
+    drive, stock = read_check_config(args.config)
+    stockChecker = StockCheckerID(drive=drive, stock=stock, credentials=creds)
+    result = stockChecker.check(args.stock)
+    for elem in result["names"]:
+        logger.debug(f"{elem['id']}, {elem['drive_name']}")
+    if args.output:
+        _write_sheets(args.output, {"IDs manquants": _names(result)})
+    if args.stats:
+        print(format_stats(result["stats"]))
+    return 0
+
+
+def cmd_check_extra(args, creds):
+    from stock_syncer import StockCheckerID, format_stats
+
+    drive, stock = read_check_config(args.config)
+    stockChecker = StockCheckerID(drive=drive, stock=stock, credentials=creds)
+    result = stockChecker.extra(args.stock)
+    for elem in result["extra"]:
+        logger.debug(f"{elem['id']}, {elem['row']}")
+    if args.output:
+        _write_sheets(
+            args.output,
+            {"IDs extra": _extra(result), "IDs dupliqués": _duplicates(result)},
+        )
+    if args.stats:
+        print(format_stats(result["stats"]))
+    return 0
+
+
+def cmd_images(args, creds):
+    from stock_syncer import StockImage
+
+    drive, stock = read_images_config(args.config)
+    stockImage = StockImage(drive=drive, stock=stock, credentials=creds)
+    images_mapping = {}
+    with open(args.urls, "r") as f:
+        lines = f.read().split("\n")
+    logger.debug(f"Number of lines: {len(lines)}")
+    for line in lines:
+        if line == "":
+            continue
+        name, url = line.split("|")
+        ugs = name.split("-")[0]
+        url = url.strip()
+        images_mapping[ugs] = url
+    logger.info(f"Number of images: {len(images_mapping)}")
+    result = stockImage.doit(images_mapping=images_mapping, dry=args.dry)
+    print(f"{result}")
+    return 0
+
+
+def cmd_report(args, creds):
+    from stock_syncer import StockPipeline, format_stats
+
+    drive, stock = read_config(args.config, names=True)
+    pipeline = StockPipeline(drive=drive, stock=stock, credentials=creds)
+    result = pipeline.run(args.stock, dry=args.dry, diff=args.diff, full=args.full)
+    print(f"Missing IDs: {len(result['missing_ids'])}")
+    print(f"Name mismatches: {len(result['names'])}")
+    print(f"Extra IDs: {len(result['extra'])}")
+    for origin, values in result["duplicates"].items():
+        print(f"Duplicated IDs in {origin}: {len(values)}")
+    if args.output:
+        _write_sheets(
+            args.output,
+            {
+                "IDs manquants": _missing_ids(result),
+                "Noms": _names(result),
+                "IDs extra": _extra(result),
+                "IDs dupliqués": _duplicates(result),
+            },
+        )
+    if "url" in result:
+        print(f"Spreadsheet URL: {result['url']}")
+    if args.stats:
+        print(format_stats(result["stats"]))
+    return 0
+
+
+class ExportDaemon(object):
+    """Sync every export dropped in a folder, with the syncers (Sheets
+    service, HTTP session, column refs and snapshots) kept between runs.
+    """
+
+    def __init__(self, args, creds, configs):
+        from stock_syncer import StockFanOut, StockSyncer
+
+        self.args = args
+        drives = [drive for drive, _ in configs]
+        stock = configs[0][1]
+        if any(other != stock for _, other in configs):
+            raise ValueError("[stock] sections of the configurations differ")
+        self.fanout = None
+        if len(configs) > 1:
+            self.fanout = StockFanOut(drives=drives, stock=stock, credentials=creds)
+            self.syncers = self.fanout.syncers
+        else:
+            self.syncers = [
+                StockSyncer(drive=drives[0], stock=stock, credentials=creds)
+            ]
+
+    def _sync(self, path) -> dict:
+        """{report sheet name: sync result}"""
+        args = self.args
+        if self.fanout is not None:
+            result = self.fanout.sync(
+                path, dry=args.dry, diff=args.diff, full=args.full
+            )
+            results = {}
+            for i, target in enumerate(result["targets"]):
+                if target["status"] != "done":
+                    logger.error(f"{target['sheetLabel']}: {target['error']}")
+                    continue
+                results[f"IDs manquants {i + 1}"] = target["result"]
+            return results
+        syncer = self.syncers[0]
+        result = syncer.sync(path, dry=args.dry, diff=args.diff, full=args.full)
+        update_res = syncer.update_error(result=result)
+        logger.info(f"Spreadsheet URL: {update_res['url']}")
+        return {"IDs manquants": result}
+
+    def sync(self, path):
+        from stock_syncer import format_stats
+
+        logger.info(f"Syncing {path}")
+        start = time.perf_counter()
+        for syncer in self.syncers:
+            # refs and columns read from the drive may have changed since
+            syncer.doc.refresh()
+        try:
+            results = self._sync(path)
+        except Exception as e:
+            logger.error(f"Sync of {path} failed: {e}")
+            with open(error_path(path), "w") as f:
+                f.write(f"{e}\n")
+            return
+        if os.path.exists(error_path(path)):
+            os.remove(error_path(path))
+        write_report(report_path(path), results)
+        for name, result in results.items():
+            logger.info(f"{name}: {len(result['missing_ids'])} missing IDs")
+            if self.args.stats:
+                print(format_stats(result["stats"]))
+        logger.info(f"{path} synced in {time.perf_counter() - start:.1f}s")
+
+    def run(self, directory):
+        watcher = FolderWatcher(directory, debounce=self.args.debounce)
+        for entry in os.scandir(directory):
+            if not is_export(entry.name):
+                continue
+            # exports synced before the daemon was (re)started
+            report = report_path(entry.path)
+            if (
+                os.path.exists(report)
+                and os.stat(report).st_mtime >= entry.stat().st_mtime
+            ):
+                watcher.mark_seen(entry.path)
+        logger.info(f"Watching {directory}")
+        for path in watcher.watch():
+            self.sync(path)
+
+
+def cmd_watch(args, creds):
+    configs = [read_config(path) for path in args.config or ["config.ini"]]
+    daemon = ExportDaemon(args, creds, configs)
+    try:
+        daemon.run(args.directory)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def _sync_options(parser):
+    parser.add_argument(
+        "--dry-run", help="Don't commit cell update", action="store_true", dest="dry"
+    )
+    parser.add_argument(
+        "--diff",
+        help="Only update cells whose value changed",
+        action="store_true",
+        dest="diff",
+    )
+    parser.add_argument(
+        "--full",
+        help="Update every product, even with an incremental configuration",
+        action="store_true",
+    )
+
+
+def build_parser() -> ArgumentParser:
+    common = ArgumentParser(add_help=False)
+    common.add_argument("--token", help="Path to store/retrieve token", required=False)
+    common.add_argument(
+        "--log",
+        dest="logLevel",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+        help="Set the logging level (default: %(default)s)",
+        default="INFO",
+    )
+    config = ArgumentParser(add_help=False)
+    config.add_argument(
+        "--config",
+        help="Path to drive/excel configuration file (default: %(default)s)",
+        required=False,
+        default="config.ini",
+    )
+    configs = ArgumentParser(add_help=False)
+    configs.add_argument(
+        "--config",
+        help="Path to drive/excel configuration file (default: config.ini), "
+        "repeat it to sync several spreadsheets concurrently",
+        required=False,
+        action="append",
+    )
+    stats = ArgumentParser(add_help=False)
+    stats.add_argument(
+        "--stats", help="Print phase timings and API counters", action="store_true"
+    )
+    output = ArgumentParser(add_help=False)
+    output.add_argument("--output", help="Path to report file")
+
+    parser = ArgumentParser(prog="stock", description="vracoop exports to drive")
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+    subparsers.required = True
+
+    sub = subparsers.add_parser(
+        "sync",
+        help="Update stocks and prices of the spreadsheet",
+        parents=[common, configs, output, stats],
+    )
+    sub.add_argument("stock", help="Path to the exported stock file")
+    _sync_options(sub)
+    sub.set_defaults(func=cmd_sync)
+
+    sub = subparsers.add_parser(
+        "check-names",
+        help="Compare product names of the export and the spreadsheet",
+        parents=[common, config, output, stats],
+    )
+    sub.add_argument("stock", help="Path to the exported stock file")
+    sub.set_defaults(func=cmd_check_names)
+
+    sub = subparsers.add_parser(
+        "check-extra",
+        help="List spreadsheet IDs missing from the export",
+        parents=[common, config, output, stats],
+    )
+    sub.add_argument("stock", help="Path to the exported stock file")
+    sub.set_defaults(func=cmd_check_extra)
+
+    sub = subparsers.add_parser(
+        "images",
+        help="Update the image URLs of the spreadsheet",
+        parents=[common, config],
+    )
+    sub.add_argument("urls", help="Path to URL list file")
+    sub.add_argument(
+        "--dry-run", help="Don't commit cell update", action="store_true", dest="dry"
+    )
+    sub.set_defaults(func=cmd_images)
+
+    sub = subparsers.add_parser(
+        "report",
+        help="Sync and run the name and extra IDs checks in a single pass",
+        parents=[common, config, output, stats],
+    )
+    sub.add_argument("stock", help="Path to the exported stock file")
+    _sync_options(sub)
+    sub.set_defaults(func=cmd_report)
+
+    sub = subparsers.add_parser(
+        "watch",
+        help="Sync every export dropped in a folder",
+        parents=[common, configs, stats],
+    )
+    sub.add_argument("directory", help="Folder where stock exports are dropped")
+    _sync_options(sub)
+    sub.add_argument(
+        "--debounce",
+        type=float,
+        default=DEBOUNCE,
+        help="Seconds an export must stay unchanged before being synced "
+        "(default: %(default)s)",
+    )
+    sub.set_defaults(func=cmd_watch)
+    return parser
+
+
+def setup_logging(level: str):
+    logger.setLevel(logging.getLevelName(level))
+    ch = logging.StreamHandler()
+    # create formatter and add it to the handlers
+    formatter = logging.Formatter(
+        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    ch.setFormatter(formatter)
+    # add the handlers to the logger
+    logger.addHandler(ch)
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    setup_logging(args.logLevel)
+    if getattr(args, "dry", False) is True:
+        logger.info("Running dry run")
+    kwargs = {}
+    if args.token:
+        kwargs["token_path"] = args.token
+    logger.info("Retrieving credentials")
+    creds = retrieve_credentials(**kwargs)
+    return args.func(args, creds)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,8 @@
+#!/usr/bin/env python
+"""Same as `stock report`, kept for existing scripts."""
+import sys
+
+from stock_cli import main
+
+if __name__ == "__main__":
+    sys.exit(main(["report"] + sys.argv[1:]))
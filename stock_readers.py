@@ -0,0 +1,284 @@
+"""Readers of the stock exports, by format.
+
+The format is detected from the first bytes of the export (see
+detect_format): xls (OLE2), xlsx and ods (zip) or csv (anything else).
+Every reader returns the same typed columns (see typed_values):
+numeric columns as float64 arrays, other ones as object arrays, empty and
+error cells as NaN. Booleans are numbers (0.0 and 1.0), like xlrd reads
+them. Readers of optional formats import their engine on first use.
+"""
+import csv
+import io
+import mmap
+import os
+import zipfile
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import xlrd
+
+import logging
+
+logger = logging.getLogger("syncer")
+
+FORMATS = ["xls", "xlsx", "ods", "csv"]
+
+OLE2_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+ZIP_MAGIC = b"PK\x03\x04"
+ODS_MIMETYPE = b"application/vnd.oasis.opendocument.spreadsheet"
+# bytes of a csv export looked at to guess its delimiter
+CSV_SNIFF_BYTES = 64 * 1024
+CSV_DELIMITERS = ",;\t"
+# semicolon separated exports (French locales) write decimals as 1,5
+CSV_DECIMALS = {";": ","}
+
+
+@contextmanager
+def _binary(source):
+    """Binary file of an export given as bytes, a path or a binary file."""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            yield f
+    elif isinstance(source, (bytes, bytearray)):
+        yield io.BytesIO(source)
+    else:
+        position = source.tell()
+        source.seek(0)
+        try:
+            yield source
+        finally:
+            source.seek(position)
+
+
+def detect_format(source) -> str:
+    """One of FORMATS, from the magic bytes of the export."""
+    with _binary(source) as f:
+        magic = f.read(len(OLE2_MAGIC))
+        if magic == OLE2_MAGIC:
+            return "xls"
+        if magic[: len(ZIP_MAGIC)] != ZIP_MAGIC:
+            return "csv"
+        f.seek(0)
+        try:
+            with zipfile.ZipFile(f) as archive:
+                if "mimetype" in archive.namelist():
+                    mimetype = archive.read("mimetype").strip()
+                    if mimetype == ODS_MIMETYPE:
+                        return "ods"
+        except zipfile.BadZipFile:
+            return "csv"
+        return "xlsx"
+
+
+def typed_values(values) -> np.ndarray:
+    """Column of Python values (None when empty) typed like _typed_column."""
+    values = np.array(values, dtype=object)
+    empty = pd.isna(values)
+    # bool is an int: booleans become 0.0 and 1.0
+    numeric = np.array(
+        [isinstance(value, (int, float, np.number, np.bool_)) for value in values],
+        dtype=bool,
+    )
+    if (numeric | empty).all():
+        column = np.full(len(values), np.nan)
+        column[numeric] = values[numeric].astype(float)
+        return column
+    values[numeric] = values[numeric].astype(float)
+    values[empty] = np.nan
+    return values
+
+
+def _typed_column(sheet, idx: int):
+    """Decode one column (title excluded) of an xlrd sheet.
+    Columns holding only numbers are returned as float64 arrays, other
+    ones as object arrays. Empty and error cells are NaN.
+    """
+    types = np.array(sheet.col_types(idx, start_rowx=1), dtype=int)
+    values = np.array(sheet.col_values(idx, start_rowx=1), dtype=object)
+    numeric = np.isin(types, [xlrd.XL_CELL_NUMBER, xlrd.XL_CELL_BOOLEAN])
+    empty = np.isin(
+        types, [xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK, xlrd.XL_CELL_ERROR]
+    )
+    if (numeric | empty).all():
+        column = np.full(len(values), np.nan)
+        column[numeric] = values[numeric].astype(float)
+        return column
+    values[numeric] = values[numeric].astype(float)
+    values[empty] = np.nan
+    return values
+
+
+def _select(header: list, titles: list, optional) -> dict:
+    """{title: column index} of the wanted titles found in `header`.
+    Missing `optional` titles are left out, other missing titles raise a
+    KeyError like pandas does.
+    """
+    indexes = {}
+    for title in list(titles) + list(optional):
+        if title in indexes:
+            continue
+        if title not in header:
+            if title in optional:
+                continue
+            raise KeyError(f"{title} not in export")
+        indexes[title] = header.index(title)
+    return indexes
+
+
+@contextmanager
+def open_export(source):
+    """xlrd workbook of an export given as bytes, a path or a binary file.
+    Files are memory-mapped (xls) or read by the zip module (xlsx) rather
+    than loaded in memory.
+    """
+    mapped = None
+    if isinstance(source, (str, os.PathLike)):
+        book = xlrd.open_workbook(filename=os.fspath(source), on_demand=True)
+    elif isinstance(source, (bytes, bytearray)):
+        book = xlrd.open_workbook(file_contents=source, on_demand=True)
+    else:
+        name = getattr(source, "name", None)
+        if isinstance(name, str) and os.path.isfile(name):
+            book = xlrd.open_workbook(filename=name, on_demand=True)
+        else:
+            try:
+                fileno = source.fileno()
+            except (AttributeError, OSError, io.UnsupportedOperation):
+                fileno = None
+            if fileno is not None:
+                mapped = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+                contents = mapped
+            else:
+                source.seek(0)
+                contents = source.read()
+            try:
+                book = xlrd.open_workbook(file_contents=contents, on_demand=True)
+            except Exception:
+                if mapped is not None:
+                    mapped.close()
+                raise
+    try:
+        yield book
+    finally:
+        book.release_resources()
+        if mapped is not None:
+            mapped.close()
+
+
+def read_xls(source, titles: list, optional=()) -> dict:
+    with open_export(source) as book:
+        sheet = book.sheet_by_index(0)
+        header = sheet.row_values(0) if sheet.nrows > 0 else []
+        indexes = _select(header, titles, optional)
+        return {title: _typed_column(sheet, idx) for title, idx in indexes.items()}
+
+
+def read_xlsx(source, titles: list, optional=()) -> dict:
+    """Rows streamed by openpyxl in read-only mode, xlrd without it."""
+    try:
+        import openpyxl
+    except ImportError:
+        logger.debug("openpyxl is not available, xlsx read by xlrd")
+        return read_xls(source, titles, optional)
+    with _binary(source) as f:
+        book = openpyxl.load_workbook(f, read_only=True, data_only=True)
+        try:
+            rows = book.worksheets[0].iter_rows()
+            header = [cell.value for cell in next(rows, ())]
+            indexes = _select(header, titles, optional)
+            columns = {title: [] for title in indexes}
+            for row in rows:
+                for title, idx in indexes.items():
+                    cell = row[idx] if idx < len(row) else None
+                    if cell is None or cell.data_type == "e":
+                        columns[title].append(None)
+                    else:
+                        columns[title].append(cell.value)
+        finally:
+            book.close()
+    return {title: typed_values(values) for title, values in columns.items()}
+
+
+def _csv_column(series: pd.Series, decimal: str = ".") -> np.ndarray:
+    """Numeric columns as float64, numbers of mixed columns as floats."""
+    if series.dtype != object:
+        return series.to_numpy(dtype=float)
+    values = series.to_numpy(dtype=object)
+    if decimal != ".":
+        # pandas only converts the decimal separator of numeric columns
+        series = series.str.replace(decimal, ".", regex=False)
+    numbers = pd.to_numeric(series, errors="coerce").to_numpy()
+    numeric = ~np.isnan(numbers)
+    values[numeric] = numbers[numeric]
+    return values
+
+
+def read_csv(source, titles: list, optional=()) -> dict:
+    """Columnar read by the pandas C parser, only the wanted columns."""
+    with _binary(source) as f:
+        sample = f.read(CSV_SNIFF_BYTES).decode("utf-8-sig", errors="ignore")
+        try:
+            delimiter = csv.Sniffer().sniff(sample, CSV_DELIMITERS).delimiter
+        except csv.Error:
+            delimiter = ","
+        decimal = CSV_DECIMALS.get(delimiter, ".")
+        header = next(csv.reader(io.StringIO(sample), delimiter=delimiter), [])
+        indexes = _select(header, titles, optional)
+        positions = sorted(set(indexes.values()))
+        f.seek(0)
+        frame = pd.read_csv(
+            f,
+            sep=delimiter,
+            usecols=positions,
+            encoding="utf-8-sig",
+            decimal=decimal,
+            # only empty cells are missing, like in spreadsheets
+            keep_default_na=False,
+            na_values=[""],
+            skip_blank_lines=False,
+        )
+    # usecols keeps the columns in file order
+    return {
+        title: _csv_column(frame.iloc[:, positions.index(idx)], decimal)
+        for title, idx in indexes.items()
+    }
+
+
+def read_ods(source, titles: list, optional=()) -> dict:
+    """Read by the pandas odf engine (odfpy)."""
+    with _binary(source) as f:
+        frame = pd.read_excel(
+            f,
+            engine="odf",
+            sheet_name=0,
+            header=None,
+            dtype=object,
+            keep_default_na=False,
+            na_values=[""],
+        )
+    header = list(frame.iloc[0]) if len(frame) > 0 else []
+    indexes = _select(header, titles, optional)
+    return {
+        title: typed_values(
+            [None if pd.isna(value) else value for value in frame.iloc[1:, idx]]
+        )
+        for title, idx in indexes.items()
+    }
+
+
+READERS = {
+    "xls": read_xls,
+    "xlsx": read_xlsx,
+    "ods": read_ods,
+    "csv": read_csv,
+}
+
+
+def read_columns(source, titles: list, optional=()) -> dict:
+    """{title: typed column} of the first sheet of an export of any of
+    FORMATS, given as bytes, a path or a binary file.
+    """
+    export_format = detect_format(source)
+    logger.debug(f"Reading {export_format} export")
+    return READERS[export_format](source, titles, optional)
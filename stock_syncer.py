@@ -1,10 +1,28 @@
-from math import floor
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build_from_document
+from googleapiclient.errors import HttpError
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import httplib2
 import pandas as pd
-import xlrd
+import json
+import os
 import re
+import random
+import tempfile
+import threading
+import time
 from datetime import datetime
-from numpy import isnan
+import numpy as np
+
+from stock_cache import (
+    CACHE_DIR,
+    SNAPSHOT_PROBE_TTL,
+    export_cache,
+    sheet_snapshots,
+    sync_states,
+)
+from stock_readers import read_columns
+from stock_transport import TRANSIENT_ERRORS, session_http
 
 import logging
 
@@ -17,7 +35,40 @@ TVA_VALUE_MAPPING = {
     "__export__.account_tax_2": "taux-normal",
 }
 
+PRODUCT_ID_PREFIX = "__export__.product_template_"
+
 MASS_RE = re.compile(r"^\s*(?P<mass>[0-9]+)(g|ml)")
+# what the REGEXEXTRACT of the formulas takes from a conditioning
+COND_NUMBER_RE = re.compile(r"^\s*(?P<number>[0-9]+)")
+
+# How the quantity price (and the price of products sold by weight) are
+# written: a formula per row, one ARRAYFORMULA for the whole quantity
+# price column, or values computed here
+FORMULA_STRATEGIES = ["formula", "array", "value"]
+
+# discovery documents shipped with the syncer, other APIs are downloaded
+# once and cached
+DISCOVERY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "discovery")
+DISCOVERY_URL = "https://{api}.googleapis.com/$discovery/rest?version={version}"
+
+# commit_batch splits updates in chunks of at most COMMIT_CHUNK_CELLS cells
+# sent by up to COMMIT_WORKERS threads
+COMMIT_CHUNK_CELLS = 10000
+COMMIT_WORKERS = 4
+# StockFanOut syncs up to FANOUT_WORKERS spreadsheets concurrently
+FANOUT_WORKERS = 4
+# 429 and 5xx responses are retried with a jittered exponential backoff
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 64.0
+# what is written for a product, besides its ID, in incremental sync states
+SYNC_STATE_COLUMNS = ["row", "qty", "price", "by_unit", "tva", "cond"]
+# spreadsheet metadata retrieved by DriveDocument.sheet_properties
+SHEET_PROPERTIES_FIELDS = (
+    "sheets.properties(sheetId,title,gridProperties(rowCount,columnCount))"
+)
+# API counters of DriveDocument.stats reported in results
+API_STATS = ["calls", "retries", "request_bytes", "response_bytes", "cells"]
 
 
 def col_to_a1(col):
@@ -56,6 +107,219 @@ def rowcol_to_a1(row, col, sheetLabel=None):
     return label
 
 
+def column_range_to_a1(first_row, last_row, col, sheetLabel=None):
+    """Translates a run of rows of a single column to A1 notation.
+    Rows start at index 0, like in rowcol_to_a1.
+    Example:
+    >>> column_range_to_a1(0, 3, 5)
+    F2:F5
+    """
+    label = rowcol_to_a1(first_row, col, sheetLabel=sheetLabel)
+    if last_row != first_row:
+        label = f"{label}:{col_to_a1(int(col))}{int(last_row) + 2}"
+    return label
+
+
+def _normalize_formula(formula: str) -> str:
+    # Sheets may give back formulas with ',' separators and other spacing
+    return "".join(formula.split()).replace(";", ",").upper()
+
+
+def same_cell_value(current, target) -> bool:
+    if current is None:
+        return False
+    if isinstance(target, str):
+        if target.startswith("=") and isinstance(current, str):
+            return _normalize_formula(current) == _normalize_formula(target)
+        return str(current) == target
+    try:
+        return abs(float(current) - float(target)) < 1e-9
+    except (TypeError, ValueError):
+        return False
+
+
+def column_cells(rows, col):
+    """A1 notation of cells of column `col`.
+    `rows` is either a single row or a pandas Series of rows.
+    """
+    if isinstance(rows, pd.Series):
+        return col_to_a1(int(col)) + (rows + 2).astype(str)
+    return rowcol_to_a1(rows, col)
+
+
+def retry_delay(attempt: int, retry_after=None) -> float:
+    """Delay before retrying a request, honouring the Retry-After header."""
+    if retry_after is not None:
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            pass
+    # full jitter exponential backoff
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def request_size(request) -> int:
+    """Size of the URI and body of an API request."""
+    body = getattr(request, "body", None) or ""
+    return len(getattr(request, "uri", "")) + len(body)
+
+
+def format_stats(stats: dict) -> str:
+    """Human readable phase timings and API counters of a result."""
+    lines = [
+        f"{phase:<10} {duration * 1000:10.1f} ms"
+        for phase, duration in stats["timings"].items()
+    ]
+    lines += [f"{key:<15} {value}" for key, value in stats["api"].items()]
+    return "\n".join(lines)
+
+
+def sheets_round(values: pd.Series, digits: int) -> pd.Series:
+    """ROUND of Google Sheets: halves are rounded away from zero."""
+    factor = 10 ** digits
+    return np.sign(values) * np.floor(np.abs(values) * factor + 0.5) / factor
+
+
+def quantity_price_values(price: pd.Series, cond: pd.Series) -> pd.Series:
+    """Values of the quantity price formula: price per kg/L rounded to 2
+    digits, "N/A" without a number at the start of the conditioning.
+    """
+    number = pd.to_numeric(
+        cond.map(str).str.extract(COND_NUMBER_RE)["number"], errors="coerce"
+    )
+    values = sheets_round(price * 1000 / number, 2)
+    invalid = number.isna() | (number == 0)
+    return values.astype(object).where(~invalid, "N/A")
+
+
+def sync_delta(previous: pd.DataFrame, current: pd.DataFrame) -> dict:
+    """Compare two sync states (one line per product ID, see
+    SYNC_STATE_COLUMNS). Returns the IDs of new, changed, unchanged and
+    disappeared products.
+    """
+    previous = previous.set_index("id")
+    current = current.set_index("id")
+    common = current.index.intersection(previous.index)
+    same = (
+        current.loc[common, SYNC_STATE_COLUMNS]
+        == previous.loc[common, SYNC_STATE_COLUMNS]
+    ).all(axis=1)
+    return {
+        "new": current.index.difference(previous.index).tolist(),
+        "changed": common[~same.values].tolist(),
+        "unchanged": common[same.values].tolist(),
+        "disappeared": previous.index.difference(current.index).tolist(),
+    }
+
+
+def split_chunks(data: list, max_cells: int) -> list:
+    """Split a ValueRange list in chunks of at most `max_cells` cells.
+    A single range bigger than `max_cells` gets its own chunk.
+    """
+    chunks = []
+    chunk = []
+    cells = 0
+    for value_range in data:
+        size = sum(len(values) for values in value_range["values"])
+        if chunk and cells + size > max_cells:
+            chunks.append(chunk)
+            chunk = []
+            cells = 0
+        chunk.append(value_range)
+        cells += size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def _discovery_document(api: str, version: str) -> str:
+    for directory in (DISCOVERY_DIR, CACHE_DIR):
+        path = os.path.join(directory, f"{api}.{version}.json")
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                return f.read()
+    logger.info(f"Downloading {api} {version} discovery document")
+    url = DISCOVERY_URL.format(api=api, version=version)
+    resp, content = httplib2.Http().request(url)
+    if resp.status >= 400:
+        raise HttpError(resp, content, uri=url)
+    document = content.decode("utf-8")
+    # validate before caching
+    json.loads(document)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        f.write(document)
+    os.replace(tmp_path, path)
+    return document
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def google_service(api: str, version: str, credentials):
+    """Service built from the cached discovery document.
+    Services are shared process wide, one per API and credentials object.
+    """
+    key = (api, version, id(credentials))
+    with _services_lock:
+        service = _services.get(key, None)
+        if service is None or service[0] is not credentials:
+            document = _discovery_document(api, version)
+            service = (
+                credentials,
+                build_from_document(document, credentials=credentials),
+            )
+            _services[key] = service
+        return service[1]
+
+
+def sheets_service(credentials):
+    return google_service("sheets", "v4", credentials)
+
+
+def drive_service(credentials):
+    return google_service("drive", "v3", credentials)
+
+
+def read_stock(source, titles: list, *, optional=()) -> pd.DataFrame:
+    """Read only the `titles` columns of the first sheet of an export (xls,
+    xlsx, ods or csv), given as bytes, a path or a binary file.
+    Missing `optional` titles are left out, other missing titles raise a
+    KeyError like pandas does. Parsed columns are kept in the export cache.
+    """
+    cache = export_cache()
+    wanted = list(dict.fromkeys(list(titles) + list(optional)))
+    columns = {}
+    missing = wanted
+    if cache is not None:
+        key = cache.key(source)
+        missing = []
+        for title in wanted:
+            hit, values = cache.get(key, title)
+            if not hit:
+                missing.append(title)
+            elif values is not None:
+                columns[title] = values
+            elif title not in optional:
+                raise KeyError(f"{title} not in export")
+    if len(missing) > 0:
+        parsed = read_columns(
+            source,
+            [title for title in titles if title in missing],
+            [title for title in optional if title in missing],
+        )
+        columns.update(parsed)
+        if cache is not None:
+            for title in missing:
+                cache.put(key, title, parsed.get(title, None))
+            cache.evict()
+    else:
+        logger.debug(f"Export loaded from cache {key}")
+    return pd.DataFrame({title: columns[title] for title in wanted if title in columns})
+
+
 def check_duplicated(values):
     aserie = pd.Series(values)
     aduplicated = aserie.duplicated()
@@ -64,56 +328,395 @@ def check_duplicated(values):
     return duplicated_values
 
 
+def duplicated_rows(values, ignore=()) -> list:
+    """Values appearing more than once, with all their rows.
+    Values in `ignore` (like empty cells) are not reported.
+    """
+    aserie = pd.Series(values, dtype=object)
+    duplicated_values = set(check_duplicated(aserie)) - set(ignore)
+    if len(duplicated_values) == 0:
+        return []
+    aserie = aserie[aserie.isin(duplicated_values)]
+    return [
+        {"id": value, "rows": rows.tolist()}
+        for value, rows in aserie.groupby(aserie, sort=False).groups.items()
+    ]
+
+
+class BatchUpdate(object):
+    """Cell updates grouped by column.
+    Adjacent rows of a column are sent as one multi-row range, gaps are left
+    untouched.
+    """
+
+    def __init__(self, *, sheetLabel):
+        self.sheetLabel = sheetLabel
+        self._columns = {}
+
+    def add(self, row, col, value, *, sheetLabel=None):
+        if sheetLabel is None:
+            sheetLabel = self.sheetLabel
+        cells = self._columns.setdefault((sheetLabel, int(col)), {})
+        cells[int(row)] = value
+
+    def __len__(self):
+        return sum(len(cells) for cells in self._columns.values())
+
+    def add_many(self, rows, col, values, *, sheetLabel=None):
+        if sheetLabel is None:
+            sheetLabel = self.sheetLabel
+        if isinstance(rows, pd.Series):
+            rows = rows.tolist()
+        if isinstance(values, pd.Series):
+            values = values.tolist()
+        cells = self._columns.setdefault((sheetLabel, int(col)), {})
+        cells.update(zip(rows, values))
+
+    def drop_rows(self, rows, *, sheetLabel=None) -> int:
+        """Remove the updates of `rows` in every column of a sheet.
+        Returns the number of dropped updates.
+        """
+        if sheetLabel is None:
+            sheetLabel = self.sheetLabel
+        rows = set(rows)
+        dropped = 0
+        for (label, _), cells in self._columns.items():
+            if label != sheetLabel:
+                continue
+            for row in rows.intersection(cells):
+                del cells[row]
+                dropped += 1
+        return dropped
+
+    def drop_unchanged(self, col, current: list, *, sheetLabel=None) -> int:
+        """Remove updates of column `col` whose target value is already in
+        `current` (column values indexed by row).
+        Returns the number of dropped updates.
+        """
+        if sheetLabel is None:
+            sheetLabel = self.sheetLabel
+        cells = self._columns.get((sheetLabel, int(col)), {})
+        unchanged = [
+            row
+            for row, value in cells.items()
+            if row < len(current) and same_cell_value(current[row], value)
+        ]
+        for row in unchanged:
+            del cells[row]
+        return len(unchanged)
+
+    def data(self) -> list:
+        data = []
+        for (sheetLabel, col), cells in self._columns.items():
+            rows = sorted(cells)
+            start = 0
+            for idx in range(1, len(rows) + 1):
+                if idx < len(rows) and rows[idx] == rows[idx - 1] + 1:
+                    continue
+                run = rows[start:idx]
+                range_name = column_range_to_a1(
+                    run[0], run[-1], col, sheetLabel=sheetLabel
+                )
+                data.append(
+                    {
+                        "range": range_name,
+                        "majorDimension": "COLUMNS",
+                        "values": [[cells[row] for row in run]],
+                    }
+                )
+                start = idx
+        return data
+
+
+def written_columns(data: list) -> set:
+    """(sheetLabel, column name) of every range of a ValueRange list."""
+    columns = set()
+    for value_range in data:
+        sheetLabel, a1 = value_range["range"].rsplit("!", 1)
+        columns.add((sheetLabel, re.match("[A-Z]+", a1).group()))
+    return columns
+
+
 class DriveDocument(object):
-    def __init__(self, *, sheetId, sheetLabel, credentials):
-        # see
-        # https://stackoverflow.com/questions/40154672/importerror-file-cache-is-unavailable-when-using-python-client-for-google-ser
-        service = build("sheets", "v4", credentials=credentials, cache_discovery=False)
+    def __init__(
+        self, *, sheetId, sheetLabel, credentials, snapshot=None, service=None
+    ):
+        # service: stand-in for the Sheets and Drive services, see sheets_emulator
+        if service is None:
+            service = sheets_service(credentials)
         self.sheet = service.spreadsheets()
+        self.credentials = credentials
         self.spreadsheetId = sheetId
         self.sheetLabel = sheetLabel
         self._column_titles = {}
+        # {sheet title: properties}, see sheet_properties
+        self._properties = None
+        # API_STATS counters, updated from the commit threads
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+        # retrieved columns, keyed by (sheetLabel, column name, formula)
+        self._columns = {}
+        # snapshot cache of title rows and columns, checked against the
+        # drive revision of the spreadsheet
+        self.snapshot = snapshot
+        self._revision = None
+        self._probed = None
+        # snapshot revision confirmed right before our writes, see _written
+        self._write_base = None
+        if snapshot is not None:
+            if hasattr(service, "files"):
+                self._files = service.files()
+            else:
+                self._files = drive_service(credentials).files()
+
+    def _http(self):
+        # pooled session shared by the threads of every document
+        if self.credentials is None:
+            return None
+        return session_http(self.credentials)
+
+    def _count(self, **counts):
+        with self._stats_lock:
+            self.stats.update(counts)
+
+    def _execute(self, request):
+        attempt = 0
+        while True:
+            self._count(calls=1, request_bytes=request_size(request))
+            try:
+                result = request.execute(http=self._http())
+            except HttpError as e:
+                status = e.resp.status
+                if (status != 429 and status < 500) or attempt >= MAX_RETRIES:
+                    raise
+                self._count(retries=1)
+                delay = retry_delay(attempt, e.resp.get("retry-after", None))
+                logger.warning(
+                    f"Sheets API error {status}, retrying in {delay:.1f}s"
+                )
+                time.sleep(delay)
+                attempt += 1
+                continue
+            except TRANSIENT_ERRORS as e:
+                if attempt >= MAX_RETRIES:
+                    raise
+                self._count(retries=1)
+                delay = retry_delay(attempt)
+                logger.warning(f"Sheets API {e!r}, retrying in {delay:.1f}s")
+                time.sleep(delay)
+                attempt += 1
+                continue
+            # decoded response, measured re-encoded
+            self._count(response_bytes=len(json.dumps(result)))
+            return result
+
+    def _fetch_revision(self):
+        try:
+            result = self._execute(
+                self._files.get(fileId=self.spreadsheetId, fields="version")
+            )
+        except HttpError as e:
+            logger.warning(f"Can't probe spreadsheet revision, no snapshot: {e}")
+            self.snapshot = None
+            return None
+        self._probed = time.monotonic()
+        return result["version"]
+
+    def _probe_revision(self):
+        if self.snapshot is None:
+            return
+        if (
+            self._probed is not None
+            and time.monotonic() - self._probed < SNAPSHOT_PROBE_TTL
+        ):
+            return
+        revision = self._fetch_revision()
+        if revision is None or revision == self._revision:
+            return
+        self._revision = revision
+        self._column_titles = {}
+        self._columns = {}
+        snapshot = self.snapshot.load(self.spreadsheetId, revision)
+        if snapshot is not None:
+            self._column_titles, self._columns = snapshot
+
+    def refresh(self):
+        """Forget the title rows and columns read so far, before the next
+        run of a long lived document. Snapshots are kept: they are checked
+        against the revision of the spreadsheet, probed again.
+        """
+        self._probed = None
+        if self.snapshot is None:
+            self._column_titles = {}
+            self._columns = {}
+
+    def _save_snapshot(self):
+        if self.snapshot is None or self._revision is None:
+            return
+        self.snapshot.save(
+            self.spreadsheetId, self._revision, self._column_titles, self._columns
+        )
+
+    def _before_write(self):
+        """Check that nobody edited the spreadsheet since the snapshot was
+        taken, right before we write to it.
+        """
+        self._write_base = None
+        if self.snapshot is None or self._revision is None:
+            return
+        if self._fetch_revision() == self._revision:
+            self._write_base = self._revision
+
+    def _written(self, columns: set):
+        # Only the written columns are outdated: the other ones hold raw
+        # values (IDs, names, conditioning) that our writes don't change.
+        self._columns = {
+            key: values
+            for key, values in self._columns.items()
+            if (key[0], key[1]) not in columns
+        }
+        snapshot = self.snapshot
+        if snapshot is None:
+            return
+        revision = None
+        if self._write_base is not None and self._write_base == self._revision:
+            revision = self._fetch_revision()
+        self._write_base = None
+        if revision is None:
+            # someone else edited the spreadsheet since the snapshot: the
+            # next run reads it again
+            snapshot.invalidate(self.spreadsheetId)
+            self._revision = None
+            self._probed = None
+            return
+        # only our writes happened since the snapshot was taken (but for
+        # edits made while they were sent): the other columns are still
+        # valid at the new revision
+        self._revision = revision
+        self._save_snapshot()
+
+    @staticmethod
+    def _column_values(values: list) -> list:
+        data = []
+        # First element is column title
+        for vv in values[1:]:
+            if len(vv) == 1:
+                value = vv[0]
+            else:
+                value = None
+            data.append(value)
+        return data
 
     def retrieve_column(self, column_name, formula=False, *, sheetLabel=None) -> list:
         if sheetLabel is None:
             sheetLabel = self.sheetLabel
+        self._probe_revision()
+        data = self._columns.get((sheetLabel, column_name, formula), None)
+        if data is not None:
+            return data
         range = f"{sheetLabel}!{column_name}:{column_name}"
         kwargs = {}
         if formula is True:
             kwargs["valueRenderOption"] = "FORMULA"
-        result = (
+        result = self._execute(
             self.sheet.values()
             .get(spreadsheetId=self.spreadsheetId, range=range, **kwargs)
-            .execute()
         )
         values = result.get("values", [])
-        data = []
-        # First element is column title
-        for vv in values[1:]:
-            if len(vv) == 1:
-                value = vv[0]
-            else:
-                value = None
-            data.append(value)
+        data = self._column_values(values)
+        self._columns[(sheetLabel, column_name, formula)] = data
+        self._save_snapshot()
         return data
 
+    def fetch_headers(self, sheetLabels: list, refresh: bool = False):
+        """Retrieve the title row of several sheets with one batchGet."""
+        self._probe_revision()
+        labels = [
+            label
+            for label in dict.fromkeys(sheetLabels)
+            if refresh is True or self._column_titles.get(label, None) is None
+        ]
+        if len(labels) == 0:
+            return
+        result = self._execute(
+            self.sheet.values()
+            .batchGet(
+                spreadsheetId=self.spreadsheetId,
+                ranges=[f"{label}!1:1" for label in labels],
+            )
+        )
+        for label, value_range in zip(labels, result.get("valueRanges", [])):
+            values = value_range.get("values", [])
+            # we retrieve only 1 row
+            self._column_titles[label] = values[0] if values else []
+        self._save_snapshot()
+
+    def _split_title(self, title) -> (str, str):
+        if isinstance(title, tuple):
+            return title
+        return self.sheetLabel, title
+
+    def fetch_titles(self, titles: list):
+        """Retrieve the title rows of the sheets of `titles`, see prefetch."""
+        self.fetch_headers([self._split_title(title)[0] for title in titles])
+
+    def prefetch(self, titles=(), *, load=(), formula=False) -> dict:
+        """Resolve column titles and load columns in two round trips.
+        Items of `titles` and `load` are titles of the default sheet or
+        (sheetLabel, title) tuples. The title rows of every sheet involved
+        are fetched with one batchGet, then every column of `load` with
+        another one; `load` also accepts raw column names like "A".
+        Returns {title: (column name, column index)}.
+        """
+        titles = list(titles)
+        load = list(load)
+        self.fetch_titles(titles + load)
+        refs = {}
+        for title in titles + load:
+            sheetLabel, key = self._split_title(title)
+            refs[title] = self.get_column_ref(key, sheetLabel=sheetLabel)
+        columns = []
+        for title in load:
+            sheetLabel, key = self._split_title(title)
+            column_name, column_id = refs[title]
+            if column_id == -1 and re.fullmatch("[A-Z]+", key):
+                column_name = key
+            if column_name != "":
+                columns.append((sheetLabel, column_name))
+        columns = [
+            column
+            for column in dict.fromkeys(columns)
+            if (column[0], column[1], formula) not in self._columns
+        ]
+        if len(columns) == 0:
+            return refs
+        kwargs = {}
+        if formula is True:
+            kwargs["valueRenderOption"] = "FORMULA"
+        result = self._execute(
+            self.sheet.values()
+            .batchGet(
+                spreadsheetId=self.spreadsheetId,
+                ranges=[f"{label}!{name}:{name}" for label, name in columns],
+                **kwargs,
+            )
+        )
+        for (label, name), value_range in zip(
+            columns, result.get("valueRanges", [])
+        ):
+            values = value_range.get("values", [])
+            self._columns[(label, name, formula)] = self._column_values(values)
+        self._save_snapshot()
+        return refs
+
     def get_column_ref(
         self, key: str, refresh: bool = False, *, sheetLabel=None
     ) -> (str, int):
         if sheetLabel is None:
             sheetLabel = self.sheetLabel
         if self._column_titles.get(sheetLabel, None) is None or refresh is True:
-            result = (
-                self.sheet.values()
-                .get(spreadsheetId=self.spreadsheetId, range=f"{sheetLabel}!1:1")
-                .execute()
-            )
-            values = result.get("values", [])
-            # we retrieve only 1 row
-            values = values[0]
-            self._column_titles[sheetLabel] = values
-        else:
-            values = self._column_titles[sheetLabel]
+            self.fetch_headers([sheetLabel], refresh=True)
+        values = self._column_titles[sheetLabel]
         try:
             idx = values.index(key)
             return col_to_a1(idx), idx
@@ -126,13 +729,64 @@ class DriveDocument(object):
         range_name = rowcol_to_a1(row, col, sheetLabel=sheetLabel)
         return {"values": [[value]], "range": range_name}
 
-    def commit_batch(self, data: list):
+    def new_batch(self, *, sheetLabel=None) -> BatchUpdate:
+        if sheetLabel is None:
+            sheetLabel = self.sheetLabel
+        return BatchUpdate(sheetLabel=sheetLabel)
+
+    def _commit_chunk(self, data: list) -> dict:
         body = {"valueInputOption": "USER_ENTERED", "data": data}
-        result = (
+        result = self._execute(
             self.sheet.values()
             .batchUpdate(spreadsheetId=self.spreadsheetId, body=body)
-            .execute()
         )
+        self._count(cells=result.get("totalUpdatedCells", 0))
+        return result
+
+    def commit_batch(self, data, *, chunk_cells=None, workers=None) -> dict:
+        if chunk_cells is None:
+            chunk_cells = COMMIT_CHUNK_CELLS
+        if workers is None:
+            workers = COMMIT_WORKERS
+        if isinstance(data, BatchUpdate):
+            cells = len(data)
+            data = data.data()
+            logger.debug(f"Committing {cells} cells in {len(data)} ranges")
+        if len(data) == 0:
+            # nothing changed (diff or incremental sync)
+            return {"spreadsheetId": self.spreadsheetId, "totalUpdatedCells": 0}
+        chunks = split_chunks(data, chunk_cells)
+        self._before_write()
+        if len(chunks) <= 1:
+            try:
+                return self._commit_chunk(data)
+            finally:
+                self._written(written_columns(data))
+
+        logger.debug(f"Committing {len(chunks)} chunks with {workers} workers")
+        try:
+            with ThreadPoolExecutor(
+                max_workers=min(workers, len(chunks))
+            ) as executor:
+                results = list(executor.map(self._commit_chunk, chunks))
+        finally:
+            self._written(written_columns(data))
+        result = {
+            "spreadsheetId": self.spreadsheetId,
+            "totalUpdatedRows": 0,
+            "totalUpdatedColumns": 0,
+            "totalUpdatedCells": 0,
+            "responses": [],
+            "chunks": len(chunks),
+        }
+        sheets = set()
+        for chunk_result in results:
+            for key in ["totalUpdatedRows", "totalUpdatedColumns", "totalUpdatedCells"]:
+                result[key] += chunk_result.get(key, 0)
+            for response in chunk_result.get("responses", []):
+                sheets.add(response.get("updatedRange", "").split("!")[0])
+                result["responses"].append(response)
+        result["totalUpdatedSheets"] = len(sheets)
         return result
 
     def clear_column(self, col, *, sheetLabel=None) -> dict:
@@ -141,22 +795,40 @@ class DriveDocument(object):
         # starting element:
         start = rowcol_to_a1(row=1, col=col, sheetLabel=sheetLabel)
         arange = f"{start}:{col_to_a1(col)}"
-        result = (
-            self.sheet.values()
-            .clear(spreadsheetId=self.spreadsheetId, range=arange)
-            .execute()
-        )
+        self._before_write()
+        try:
+            result = self._execute(
+                self.sheet.values()
+                .clear(spreadsheetId=self.spreadsheetId, range=arange)
+            )
+        finally:
+            self._written({(sheetLabel, col_to_a1(col))})
         return result
     
+    def sheet_properties(self, refresh: bool = False) -> dict:
+        """ID and grid size of every sheet, by title:
+        {title: {"sheetId", "rowCount", "columnCount"}}. Retrieved once.
+        """
+        if self._properties is None or refresh is True:
+            result = self._execute(
+                self.sheet.get(
+                    spreadsheetId=self.spreadsheetId, fields=SHEET_PROPERTIES_FIELDS
+                )
+            )
+            properties = {}
+            for sheet in result.get("sheets", []):
+                sheet_properties = sheet["properties"]
+                grid = sheet_properties.get("gridProperties", {})
+                properties[sheet_properties["title"]] = {
+                    "sheetId": sheet_properties["sheetId"],
+                    "rowCount": grid.get("rowCount", 0),
+                    "columnCount": grid.get("columnCount", 0),
+                }
+            self._properties = properties
+        return self._properties
+
     def get_sheet_URL(self, sheetLabel) -> str:
-        sheetId = None
-        result = self.sheet.get(spreadsheetId=self.spreadsheetId).execute()
-        for sheet in result['sheets']:
-            properties = sheet['properties']
-            label = properties['title']
-            if label == sheetLabel:
-                sheetId = properties['sheetId']
-                break
+        sheetId = self.sheet_properties().get(sheetLabel, {}).get("sheetId", None)
         if sheetId is not None:
             return f"https://docs.google.com/spreadsheets/d/{self.spreadsheetId}/edit#gid={sheetId}"
         else:
@@ -164,19 +836,68 @@ class DriveDocument(object):
 
 
 class Stock(object):
-    def __init__(self, *, drive: dict, stock: dict, credentials):
+    def __init__(
+        self, *, drive: dict, stock: dict, credentials, progress=None, service=None
+    ):
         # Call the Sheets API
+        snapshot = None
+        if drive.get("snapshot", False) is True:
+            snapshot = sheet_snapshots()
         self.doc = DriveDocument(
             sheetId=drive["sheetId"],
             sheetLabel=drive["sheetLabel"],
             credentials=credentials,
+            snapshot=snapshot,
+            service=service,
         )
         self.drive = drive
         self.stock = stock
+        # last synced export of the sheet, for incremental syncs
+        self.sync_states = None
+        if drive.get("incremental", False) is True:
+            self.sync_states = sync_states()
+        self._pending_state = None
+        # column cleared before the commit of a sync
+        self._clear_column = None
         self.product_ids = []
         self.product_ids_mapping = {}
         self.drive_column_title = None
         self._column_title = None
+        # called with the name of each phase when it starts
+        self.progress = progress
+        # seconds spent in each phase of the current operation
+        self.timings = {}
+        self._current_phase = None
+        self._stats_base = Counter()
+
+    def _end_phase(self):
+        if self._current_phase is not None:
+            name, start = self._current_phase
+            elapsed = time.perf_counter() - start
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+            self._current_phase = None
+
+    def _phase(self, name: str):
+        logger.debug(f"Phase: {name}")
+        self._end_phase()
+        self._current_phase = (name, time.perf_counter())
+        if self.progress is not None:
+            self.progress(name)
+
+    def _start_stats(self):
+        self._end_phase()
+        self.timings = {}
+        self._stats_base = Counter(self.doc.stats)
+
+    def _stats(self) -> dict:
+        """Phase timings and API counters since the last _start_stats."""
+        self._end_phase()
+        api = Counter(self.doc.stats)
+        api.subtract(self._stats_base)
+        return {
+            "timings": dict(self.timings),
+            "api": {key: api[key] for key in API_STATS},
+        }
 
     def _retrieve_product_ids(self):
         values = self.doc.retrieve_column(column_name="A")
@@ -194,6 +915,8 @@ class Stock(object):
             idx = idx + 1
         self.product_ids = ids
         self.product_ids_mapping = ids_mapping
+        for product_id in set(check_duplicated(ids)) - {-1}:
+            logger.warning(f"Duplicated ID {product_id} in drive, last row is used")
         return ids
 
     def _retrieve_column(self, column_name, *, sheetLabel=None) -> list:
@@ -205,32 +928,218 @@ class Stock(object):
             logger.error(f"Error retrieving column {key}")
         return name, id
 
+    def _prefetch(self, titles=(), *, load=(), formula=False) -> dict:
+        refs = self.doc.prefetch(titles, load=load, formula=formula)
+        for title in titles:
+            name, id = refs[title]
+            if id == -1:
+                logger.error(f"Error retrieving column {title}")
+        return refs
+
+    def _fetch(self, titles=(), *, load=()) -> dict:
+        """_prefetch in a "refs" phase (title rows) and a "fetch" phase
+        (columns)."""
+        self._phase("refs")
+        self.doc.fetch_titles(list(titles) + list(load))
+        self._phase("fetch")
+        return self._prefetch(titles, load=load)
+
     def _batch_element(self, row, col, value, *, sheetLabel=None) -> dict:
         return self.doc.batch_element(
             row=row, col=col, value=value, sheetLabel=sheetLabel
         )
 
-    def _commit_batch(self, data: list):
+    def _new_batch(self, *, sheetLabel=None) -> BatchUpdate:
+        return self.doc.new_batch(sheetLabel=sheetLabel)
+
+    def _commit_batch(self, data):
         return self.doc.commit_batch(data=data)
 
     def _conditioned_formula(self, *, row, quantity_price_column_id, cond_column_id):
         # =AE2*VALUE(REGEXEXTRACT(AG2;"^\s*[0-9]+")) / 1000
-        quantity_price_cell = rowcol_to_a1(row, quantity_price_column_id)
-        cond_cell = rowcol_to_a1(row, cond_column_id)
-        formula = f'={quantity_price_cell} * VALUE(REGEXEXTRACT({cond_cell}; "^\s*[0-9]+")) / 1000'
+        # `row` may be a single row or a Series of rows
+        quantity_price_cell = column_cells(row, quantity_price_column_id)
+        cond_cell = column_cells(row, cond_column_id)
+        formula = (
+            "="
+            + quantity_price_cell
+            + ' * VALUE(REGEXEXTRACT('
+            + cond_cell
+            + '; "^\s*[0-9]+")) / 1000'
+        )
+        return formula
+
+    def _array_quantity_price_formula(self, *, price_column_id, cond_column_id):
+        # _quantity_price_formula of the whole column, from row 2
+        price_column = col_to_a1(price_column_id)
+        cond_column = col_to_a1(cond_column_id)
+        price_cells = f"{price_column}2:{price_column}"
+        cond_cells = f"{cond_column}2:{cond_column}"
+        formula = (
+            "=ARRAYFORMULA(IF("
+            + price_cells
+            + ' = ""; ""; IFERROR(ROUND('
+            + price_cells
+            + " * 1000 / VALUE(REGEXEXTRACT("
+            + cond_cells
+            + '; "^\s*[0-9]+")); 2); "N/A")))'
+        )
         return formula
 
     def _quantity_price_formula(self, *, row, price_column_id, cond_column_id):
-        price_cell = rowcol_to_a1(row, price_column_id)
-        cond_cell = rowcol_to_a1(row, cond_column_id)
-        formula = f'=IFERROR(ROUND({price_cell} * 1000 / VALUE(REGEXEXTRACT({cond_cell}; "^\s*[0-9]+")); 2); "N/A")'
+        # `row` may be a single row or a Series of rows
+        price_cell = column_cells(row, price_column_id)
+        cond_cell = column_cells(row, cond_column_id)
+        formula = (
+            "=IFERROR(ROUND("
+            + price_cell
+            + " * 1000 / VALUE(REGEXEXTRACT("
+            + cond_cell
+            + '; "^\s*[0-9]+")); 2); "N/A")'
+        )
         return formula
 
 
 class StockSyncer(Stock):
-    def sync(self, xls_data: bytes, dry: bool = False):
-        book = xlrd.open_workbook(file_contents=xls_data)
-        tmp = pd.read_excel(book, engine="xlrd")
+    def _sync_transform(
+        self,
+        stock,
+        batch: BatchUpdate,
+        *,
+        product_cond: list,
+        stock_column_id: int,
+        price_column_id: int,
+        quantity_price_column_id: int,
+        cond_column_id: int,
+        tva_column_id: int = None,
+        strategy: str = "formula",
+    ):
+        """Compute the drive updates of a whole export at once.
+        `stock` columns are ID, quantity, price, name, by unit flag and
+        optionally TVA. Returns missing IDs, missing conditionings, the
+        number of dropped lines and the sync state of the updated products.
+        With the "array" `strategy`, the quantity price column is left to
+        the ARRAYFORMULA of _array_formula.
+        """
+        ids = stock.iloc[:, 0].astype(object)
+        qty = pd.to_numeric(stock.iloc[:, 1], errors="coerce")
+        price = pd.to_numeric(stock.iloc[:, 2], errors="coerce")
+        names = stock.iloc[:, 3]
+        by_unit = stock.iloc[:, 4] == 0.0
+
+        is_str = ids.map(type) == str
+        product_ids = (
+            ids[is_str]
+            .str.replace(PRODUCT_ID_PREFIX, "", regex=False)
+            .reindex(ids.index)
+        )
+        # empty lines are skipped
+        valid = product_ids.notna() & qty.notna() & price.notna()
+        count = int((~valid).sum())
+        rows = product_ids[valid].map(self.product_ids_mapping)
+        matched = rows.notna().reindex(stock.index, fill_value=False)
+        rows = rows[rows.notna()].astype(int)
+
+        missing = valid & ~matched & (qty > 0)
+        for product_id in product_ids[missing]:
+            logger.debug(f"{product_id} not found in drive")
+        missing_ids = [
+            {"id": product_id, "name": name}
+            for product_id, name in zip(
+                product_ids[missing].tolist(), names[missing].tolist()
+            )
+        ]
+
+        no_cond = rows >= len(product_cond)
+        for product_id, row in zip(product_ids[rows.index[no_cond]], rows[no_cond]):
+            logger.warning(f"No conditionning for {product_id} [{row}]")
+        missing_conds = product_ids[rows.index[no_cond]].tolist()
+        conds = pd.Series(product_cond + [None], dtype=object)
+        cond = pd.Series(
+            conds.values[rows.clip(upper=len(product_cond)).values], index=rows.index
+        )
+
+        unit = rows.index[by_unit[rows.index].values]
+        weight = rows.index[~by_unit[rows.index].values]
+        mass = pd.to_numeric(
+            cond[weight].str.extract(MASS_RE)["mass"], errors="coerce"
+        )
+        for idx in mass.index[mass.isna()]:
+            logger.error(
+                f"Attribute Error for {product_ids[idx]}/{rows[idx]} '{cond[idx]}'"
+            )
+        for idx in mass.index[mass == 0]:
+            logger.error(f"Wrong conditionning for {product_ids[idx]} '{cond[idx]}'")
+        weight = mass.index[mass > 0]
+        # last line wins when an ID is exported twice
+        updated = unit.append(weight).sort_values()
+        updated = updated[~rows[updated].duplicated(keep="last").values]
+        unit = unit.intersection(updated)
+        weight = weight.intersection(updated)
+        mass = mass[weight]
+
+        # Products sold by unit
+        unit_rows = rows[unit]
+        batch.add_many(unit_rows, stock_column_id, qty[unit])
+        batch.add_many(unit_rows, price_column_id, price[unit])
+        if strategy == "formula":
+            batch.add_many(
+                unit_rows,
+                quantity_price_column_id,
+                self._quantity_price_formula(
+                    row=unit_rows,
+                    price_column_id=price_column_id,
+                    cond_column_id=cond_column_id,
+                ),
+            )
+        elif strategy == "value":
+            batch.add_many(
+                unit_rows,
+                quantity_price_column_id,
+                quantity_price_values(price[unit], cond[unit]),
+            )
+
+        # Products sold by weight
+        weight_rows = rows[weight]
+        product_units = np.floor(qty[weight] * 1000 / mass).clip(lower=0).astype(int)
+        batch.add_many(weight_rows, stock_column_id, product_units)
+        if strategy == "formula":
+            batch.add_many(
+                weight_rows,
+                price_column_id,
+                self._conditioned_formula(
+                    row=weight_rows,
+                    quantity_price_column_id=quantity_price_column_id,
+                    cond_column_id=cond_column_id,
+                ),
+            )
+        else:
+            batch.add_many(weight_rows, price_column_id, price[weight] * mass / 1000)
+        if strategy != "array":
+            batch.add_many(weight_rows, quantity_price_column_id, price[weight])
+
+        if tva_column_id is not None:
+            tva_values = stock.iloc[:, 5][updated].map(TVA_VALUE_MAPPING).dropna()
+            batch.add_many(rows[tva_values.index], tva_column_id, tva_values)
+
+        state = pd.DataFrame(
+            {
+                "id": product_ids[updated].values,
+                "row": rows[updated].values,
+                "qty": qty[updated].values,
+                "price": price[updated].values,
+                "by_unit": by_unit[updated].values,
+                "tva": (
+                    stock.iloc[:, 5][updated].map(str).values
+                    if tva_column_id is not None
+                    else ""
+                ),
+                "cond": cond[updated].map(str).values,
+            }
+        )
+        return missing_ids, missing_conds, count, state
+
+    def _read_sync_stock(self, xls_data) -> (pd.DataFrame, bool):
         stock_keys = [
             self.stock["ID_title"],
             self.stock["stock_title"],
@@ -239,148 +1148,180 @@ class StockSyncer(Stock):
             self.stock["by_unit_title"],
         ]
         tva_key = self.stock.get("TVA_title", None)
+        optional = [tva_key] if tva_key is not None else []
+        tmp = read_stock(xls_data, stock_keys, optional=optional)
         tva = False
-        if tva_key is not None:
-            wait = tmp.get(tva_key, None)
-            if wait is not None:
-                logger.info("TVA enabled")
-                tva = True
+        if tva_key is not None and tva_key in tmp:
+            logger.info("TVA enabled")
+            tva = True
         if tva is True:
             stock_keys.append(self.stock["TVA_title"])
 
-        stock = tmp[stock_keys]
-        logger.info("Retrieving drive columns ref")
-        logger.debug(f"Retrieving drive stock column ref {self.drive['stock_title']}")
-        stock_column_name, stock_column_id = self._get_column_ref(
-            self.drive["stock_title"]
+        return tmp[stock_keys], tva
+
+    def _sync_titles(self, tva: bool) -> list:
+        titles = [
+            self.drive["stock_title"],
+            self.drive["price_title"],
+            self.drive["quantity_price_title"],
+            self.drive["cond_title"],
+            self.drive["ID_title"],
+        ]
+        if tva is True:
+            titles.append(self.drive["TVA_title"])
+        errors_sheet = self.drive.get("errors_sheet", None)
+        if errors_sheet is not None:
+            # warm up title row of errors sheet for update_error
+            titles.append((errors_sheet, self.drive["missing_UGS_title"]))
+        return titles
+
+    def _formula_strategy(self) -> str:
+        strategy = self.drive.get("formula_strategy", "formula")
+        if strategy not in FORMULA_STRATEGIES:
+            raise ValueError(f"Unknown formula strategy {strategy}")
+        return strategy
+
+    def _sync_layout(self, refs: dict, tva: bool) -> str:
+        titles = self._sync_titles(tva)[:5 + int(tva)]
+        layout = [str(refs[title][1]) for title in titles]
+        return ",".join(layout + [self._formula_strategy()])
+
+    def _array_formula(
+        self,
+        batch: BatchUpdate,
+        *,
+        quantity_price_column: tuple,
+        price_column_id: int,
+        cond_column_id: int,
+    ):
+        """Install the ARRAYFORMULA of the quantity price column, unless it
+        is already there. The column has to be cleared first for the
+        formula to expand, see _commit_sync.
+        """
+        quantity_price_column_name, quantity_price_column_id = quantity_price_column
+        formula = self._array_quantity_price_formula(
+            price_column_id=price_column_id, cond_column_id=cond_column_id
         )
-        logger.debug(f"Retrieving drive price column ref {self.drive['price_title']}")
-        price_column_name, price_column_id = self._get_column_ref(
-            self.drive["price_title"]
+        current = self.doc.retrieve_column(quantity_price_column_name, formula=True)
+        if len(current) > 0 and same_cell_value(current[0], formula):
+            return
+        logger.info("Installing quantity price ARRAYFORMULA")
+        batch.add(0, quantity_price_column_id, formula)
+        self._clear_column = quantity_price_column_id
+
+    def _commit_sync(self, batch: BatchUpdate):
+        if self._clear_column is not None:
+            self.doc.clear_column(col=self._clear_column)
+            self._clear_column = None
+        result_commit = self._commit_batch(batch)
+        self._save_state()
+        return result_commit
+
+    def _incremental(self, batch: BatchUpdate, state, layout: str, full: bool):
+        """Drop the updates of the products unchanged since the last synced
+        export. Returns the delta, None for a full sync.
+        """
+        self._pending_state = None
+        if self.sync_states is None:
+            return None
+        self._pending_state = (layout, state)
+        previous = None
+        if full is False:
+            previous = self.sync_states.load(
+                self.doc.spreadsheetId, self.doc.sheetLabel, layout
+            )
+        if previous is None:
+            logger.info("Full sync")
+            return None
+        delta = sync_delta(previous, state)
+        unchanged_rows = state["row"][state["id"].isin(delta["unchanged"])]
+        dropped = batch.drop_rows(unchanged_rows.tolist())
+        logger.info(
+            f"Incremental sync: {len(delta['new'])} new, "
+            f"{len(delta['changed'])} changed, "
+            f"{len(delta['disappeared'])} disappeared products "
+            f"({dropped} cells skipped)"
         )
-        logger.debug(
-            f"Retrieving drive quantity price column ref {self.drive['quantity_price_title']}"
+        return {
+            "new": delta["new"],
+            "changed": delta["changed"],
+            "unchanged": len(delta["unchanged"]),
+            "disappeared": delta["disappeared"],
+        }
+
+    def _save_state(self):
+        """Swap the sync state once the commit succeeded."""
+        if self._pending_state is None:
+            return
+        layout, state = self._pending_state
+        self.sync_states.save(
+            self.doc.spreadsheetId, self.doc.sheetLabel, layout, state
         )
-        quantity_price_column_name, quantity_price_column_id = self._get_column_ref(
+        self._pending_state = None
+
+    def _sync_batch(
+        self,
+        stock,
+        batch: BatchUpdate,
+        *,
+        refs: dict,
+        tva: bool,
+        diff: bool,
+        full: bool = False,
+    ) -> dict:
+        stock_column_name, stock_column_id = refs[self.drive["stock_title"]]
+        price_column_name, price_column_id = refs[self.drive["price_title"]]
+        quantity_price_column_name, quantity_price_column_id = refs[
             self.drive["quantity_price_title"]
-        )
-        logger.debug(f"Retrieving conditionning column ref {self.drive['cond_title']}")
-        cond_column_name, cond_column_id = self._get_column_ref(
-            self.drive["cond_title"]
-        )
+        ]
+        cond_column_name, cond_column_id = refs[self.drive["cond_title"]]
         if tva is True:
-            logger.debug(f"Retrieving TVA column ref {self.drive['TVA_title']}")
-            tva_column_name, tva_column_id = self._get_column_ref(
-                self.drive["TVA_title"]
-            )
-
-        logger.debug(
-            f"Retrieving drive product IDs column ref {self.drive['ID_title']}"
-        )
-        id_column_name, id_column_id = self._get_column_ref(self.drive["ID_title"])
+            tva_column_name, tva_column_id = refs[self.drive["TVA_title"]]
 
         self._retrieve_product_ids()
         product_cond = self._retrieve_column(column_name=cond_column_name)
 
-        data = []
-        count = 0
-        missing_ids = []
-        missing_conds = []
-        for elem in stock.values:
-            try:
-                if not isinstance(elem[0], str) or isnan(elem[1]) or isnan(elem[2]):
-                    # empty line skipped
-                    count += 1
-                    continue
-                product_id = elem[0].replace("__export__.product_template_", "")
-                product_qty = elem[1]
-                product_price = elem[2]
-                product_name = elem[3]
-                product_by_unit = elem[4]
-                row = self.product_ids_mapping.get(product_id, None)
-                if row is not None:
-                    # logger.debug(f"Row: {row}, Id: {product_id}, Qty: {product_qty}")
-                    # First row is title
-                    try:
-                        cond = product_cond[row]
-                    except:
-                        logger.warning(f"No conditionning for {product_id} [{row}]")
-                        missing_conds.append(product_id)
-
-                    if product_by_unit == 0.0:
-                        # Product sell by unit
-                        batch_entry = self._batch_element(
-                            row, stock_column_id, product_qty
-                        )
-                        data.append(batch_entry)
-                        batch_entry = self._batch_element(
-                            row, price_column_id, product_price
-                        )
-                        data.append(batch_entry)
-                        formula = self._quantity_price_formula(
-                            row=row,
-                            price_column_id=price_column_id,
-                            cond_column_id=cond_column_id,
-                        )
-                        batch_entry = self._batch_element(
-                            row, quantity_price_column_id, formula
-                        )
-                        data.append(batch_entry)
-                    else:
-                        try:
-                            mass = MASS_RE.match(cond).group("mass")
-                            mass = int(mass)
-                        except AttributeError:
-                            logger.error(
-                                f"Attribute Error for {product_id}/{row} '{cond}'"
-                            )
-                            continue
-                        if mass == 0:
-                            logger.error(
-                                f"Wrong conditionning for {product_id} '{cond}'"
-                            )
-                            continue
-                        product_units = floor(product_qty * 1000 / mass)
-                        if product_units < 0:
-                            product_units = 0
-                        batch_entry = self._batch_element(
-                            row, stock_column_id, product_units
-                        )
-                        data.append(batch_entry)
-                        formula = self._conditioned_formula(
-                            row=row,
-                            quantity_price_column_id=quantity_price_column_id,
-                            cond_column_id=cond_column_id,
-                        )
-                        batch_entry = self._batch_element(row, price_column_id, formula)
-                        data.append(batch_entry)
-                        batch_entry = self._batch_element(
-                            row, quantity_price_column_id, product_price
-                        )
-                        data.append(batch_entry)
-
-                    if tva is True:
-                        tva_value = elem[3]
-                        if tva_value in TVA_VALUE_MAPPING:
-                            tva_value = TVA_VALUE_MAPPING[tva_value]
-                            batch_entry = self._batch_element(
-                                row, tva_column_id, tva_value
-                            )
-                            data.append(batch_entry)
-                else:
-                    if product_qty > 0:
-                        logger.debug(f"{product_id} not found in drive")
-                        missing_ids.append({"id": product_id, "name": product_name})
+        missing_ids, missing_conds, count, state = self._sync_transform(
+            stock,
+            batch,
+            product_cond=product_cond,
+            stock_column_id=stock_column_id,
+            price_column_id=price_column_id,
+            quantity_price_column_id=quantity_price_column_id,
+            cond_column_id=cond_column_id,
+            tva_column_id=tva_column_id if tva is True else None,
+            strategy=self._formula_strategy(),
+        )
+        delta = self._incremental(batch, state, self._sync_layout(refs, tva), full)
+        self._clear_column = None
+        if self._formula_strategy() == "array":
+            self._array_formula(
+                batch,
+                quantity_price_column=(
+                    quantity_price_column_name,
+                    quantity_price_column_id,
+                ),
+                price_column_id=price_column_id,
+                cond_column_id=cond_column_id,
+            )
 
-            except AttributeError as e:
-                logger.error(f"Issue with an element: {e}")
-                count += 1
+        unchanged = 0
+        if diff is True:
+            logger.info("Retrieving current drive values")
+            diff_columns = [
+                (stock_column_name, stock_column_id),
+                (price_column_name, price_column_id),
+                (quantity_price_column_name, quantity_price_column_id),
+            ]
+            if tva is True:
+                diff_columns.append((tva_column_name, tva_column_id))
+            self._prefetch(load=[name for name, _ in diff_columns], formula=True)
+            for column_name, column_id in diff_columns:
+                current = self.doc.retrieve_column(column_name, formula=True)
+                unchanged += batch.drop_unchanged(column_id, current)
+        changed = len(batch)
+        logger.info(f"Number of changed cells: {changed} (unchanged: {unchanged})")
 
-        if dry is False:
-            result_commit = self._commit_batch(data)
-        else:
-            logger.debug("Dry run...")
-            result_commit = None
         missing_ids.sort(key=lambda elem: int(elem["id"]))
         missing_conds.sort()
 
@@ -388,68 +1329,142 @@ class StockSyncer(Stock):
         logger.info(f"Number of missing ids: {len(missing_ids)}")
         logger.info(f"Number of missing conditionning: {len(missing_conds)}")
         result = {
-            "commit": result_commit,
             "missing_ids": missing_ids,
             "missing_conditioning": missing_conds,
+            "changed": changed,
+            "unchanged": unchanged,
+            "skipped": count,
+            "delta": delta,
         }
         return result
 
-    def update_error(self, *, result):
+    def sync(self, xls_data, dry: bool = False, diff: bool = False, full=False):
+        """`xls_data` is the export as bytes, a path or a binary file.
+        `full` ignores the last synced export of incremental syncs.
+        """
+        self._start_stats()
+        self._phase("parse")
+        stock, tva = self._read_sync_stock(xls_data)
+        return self._sync_stock(stock, tva, dry=dry, diff=diff, full=full)
+
+    def sync_stock(
+        self, stock, tva: bool, dry: bool = False, diff: bool = False, full=False
+    ):
+        """sync of an export already read by _read_sync_stock."""
+        self._start_stats()
+        return self._sync_stock(stock, tva, dry=dry, diff=diff, full=full)
+
+    def _sync_stock(self, stock, tva: bool, *, dry: bool, diff: bool, full: bool):
+        logger.info("Retrieving drive columns ref and values")
+        load = ["A", self.drive["cond_title"]]
+        errors_sheet = self.drive.get("errors_sheet", None)
+        if errors_sheet is not None:
+            # missing IDs of the previous run, for update_error
+            load.append((errors_sheet, self.drive["missing_UGS_title"]))
+        refs = self._fetch(self._sync_titles(tva), load=load)
+
+        self._phase("transform")
+        batch = self._new_batch()
+        sync_result = self._sync_batch(
+            stock, batch, refs=refs, tva=tva, diff=diff, full=full
+        )
+
+        self._phase("commit")
+        if dry is False:
+            result_commit = self._commit_sync(batch)
+        else:
+            logger.debug("Dry run...")
+            result_commit = None
+        result = {"commit": result_commit}
+        result.update(sync_result)
+        result["stats"] = self._stats()
+        return result
+
+    def _error_batch(self, batch: BatchUpdate, *, result: dict, previous: int = 0):
+        """Add the errors sheet update to `batch`.
+        `previous` is the number of missing IDs currently in the sheet,
+        the rows left over are blanked.
+        """
         now = datetime.now()
         sheetLabel = self.drive["errors_sheet"]
-        logger.debug("Update error sheet")
         missing_UGS_column_name, missing_UGS_column_id = self._get_column_ref(
             self.drive["missing_UGS_title"], sheetLabel=sheetLabel
         )
-        logger.info("Clearing missing IDs")
-        self.doc.clear_column(col=missing_UGS_column_id, sheetLabel=sheetLabel)
-        data = []
         # Added date
         value = now.strftime("%Y-%m-%d %H:%M:%S")
-        batch_entry = self._batch_element(0, 0, value, sheetLabel=sheetLabel)
-        data.append(batch_entry)
+        batch.add(0, 0, value, sheetLabel=sheetLabel)
         logger.debug("Prepare missing IDs update")
         for i, missing in enumerate(result["missing_ids"]):
             row = i + 1  # a little offset
             value = f'{missing["id"]} - {missing["name"]}'
-            batch_entry = self._batch_element(
-                row, missing_UGS_column_id, value, sheetLabel=sheetLabel
-            )
-            data.append(batch_entry)
+            batch.add(row, missing_UGS_column_id, value, sheetLabel=sheetLabel)
+        for row in range(len(result["missing_ids"]) + 1, previous + 1):
+            batch.add(row, missing_UGS_column_id, "", sheetLabel=sheetLabel)
+        return missing_UGS_column_id
+
+    def _previous_errors(self, column_name: str) -> int:
+        """Number of missing IDs currently in the errors sheet."""
+        previous = self._retrieve_column(
+            column_name=column_name, sheetLabel=self.drive["errors_sheet"]
+        )
+        # first row holds the date of the previous run
+        return max(len(previous) - 1, 0)
+
+    def update_error(self, *, result):
+        sheetLabel = self.drive["errors_sheet"]
+        self._start_stats()
+        self._phase("errors")
+        logger.debug("Update error sheet")
+        batch = self._new_batch(sheetLabel=sheetLabel)
+        # blank the entries left over instead of clearing the column first,
+        # the column is prefetched by the sync
+        missing_UGS_column_name, _ = self._get_column_ref(
+            self.drive["missing_UGS_title"], sheetLabel=sheetLabel
+        )
+        previous = self._previous_errors(missing_UGS_column_name)
+        self._error_batch(batch, result=result, previous=previous)
+        properties = self.doc.sheet_properties().get(sheetLabel, {})
         logger.info("Updating missing IDs")
-        result_commit = self._commit_batch(data)
+        result_commit = self._commit_batch(batch)
+        if len(result["missing_ids"]) + 2 > properties.get("rowCount", 0):
+            # writes past the grid extended the sheet
+            self.doc.sheet_properties(refresh=True)
         logger.debug("Retrieving sheet URL")
         sheet_url = self.doc.get_sheet_URL(sheetLabel=sheetLabel)
         result = {
             'commit': result_commit,
-            'url': sheet_url
+            'url': sheet_url,
+            'stats': self._stats(),
         }
         return result
 
 
 class StockCheckerID(Stock):
-    def check(self, xls_data: bytes):
-        book = xlrd.open_workbook(file_contents=xls_data)
-        tmp = pd.read_excel(book, engine="xlrd")
+    def check(self, xls_data):
         stock_keys = [
             self.stock["ID_title"],
             self.stock["name_title"],
         ]
 
-        stock = tmp[stock_keys]
-        logger.info("Retrieving drive columns ref")
-        logger.debug("retrieving drive name column ref")
-        name_column_name, name_column_id = self._get_column_ref(
-            self.drive["name_title"]
+        self._start_stats()
+        self._phase("parse")
+        stock = read_stock(xls_data, stock_keys)
+        logger.info("Retrieving drive columns ref and values")
+        refs = self._fetch(
+            [self.drive["name_title"], self.drive["ID_title"]],
+            load=["A", self.drive["name_title"]],
         )
+        name_column_name, name_column_id = refs[self.drive["name_title"]]
 
-        logger.debug("Retrieving drive product IDs column ref")
-        id_column_name, id_column_id = self._get_column_ref(self.drive["ID_title"])
-
+        self._phase("transform")
         self._retrieve_product_ids()
         product_names = self._retrieve_column(column_name=name_column_name)
 
-        data = []
+        result = self._check_names(stock, product_names)
+        result["stats"] = self._stats()
+        return result
+
+    def _check_names(self, stock, product_names: list) -> dict:
         count = 0
         matching = []
         for elem in stock.values:
@@ -485,63 +1500,201 @@ class StockCheckerID(Stock):
         result = {"names": matching}
         return result
 
-    def extra(self, xls_data: bytes):
-        book = xlrd.open_workbook(file_contents=xls_data)
-        tmp = pd.read_excel(book, engine="xlrd")
+    def extra(self, xls_data):
         stock_keys = [
             self.stock["ID_title"],
         ]
 
-        stock = tmp[stock_keys]
-
-        logger.info("Retrieving drive columns ref")
-        logger.debug("retrieving drive name column ref")
-        name_column_name, name_column_id = self._get_column_ref(
-            self.drive["name_title"]
-        )
+        self._start_stats()
+        self._phase("parse")
+        stock = read_stock(xls_data, stock_keys)
 
-        logger.debug("Retrieving drive product IDs column ref")
-        id_column_name, id_column_id = self._get_column_ref(self.drive["ID_title"])
+        logger.info("Retrieving drive columns ref and values")
+        self._fetch([self.drive["name_title"], self.drive["ID_title"]], load=["A"])
 
+        self._phase("transform")
         self._retrieve_product_ids()
-        product_names = self._retrieve_column(column_name=name_column_name)
 
-        count = 0
+        result = self._extra_ids(stock)
+        result["stats"] = self._stats()
+        return result
+
+    def _extra_ids(self, stock) -> dict:
+        ids = stock.iloc[:, 0]
+        ids = ids[ids.map(type) == str]
+        vrac_ids = ids.str.replace(PRODUCT_ID_PREFIX, "", regex=False)
+
+        drive_ids = pd.Series(self.product_ids, dtype=object)
+        not_exported = ~drive_ids.isin(set(vrac_ids))
         extra = []
-        vrac_ids = []
-        for elem in stock.values:
-            if not isinstance(elem[0], str):
-                continue
-            vrac_ids.append(elem[0].replace("__export__.product_template_", ""))
+        for row, product_id in drive_ids[not_exported].items():
+            logger.warning(f"Row: {row}, Id: {product_id}")
+            extra.append({"row": row, "id": product_id})
 
-        for product_id in self.product_ids:
-            row = self.product_ids_mapping.get(product_id, None)
-            if not product_id in vrac_ids:
-                logger.warn(f"Row: {row}, Id: {product_id}")
-                extra.append({"row": row, "id": product_id})
+        duplicates = {
+            "drive": duplicated_rows(drive_ids, ignore=[-1]),
+            "export": duplicated_rows(vrac_ids),
+        }
+        for origin, values in duplicates.items():
+            for elem in values:
+                logger.warning(f"Duplicated ID {elem['id']} in {origin}: {elem['rows']}")
 
-        result = {"extra": extra}
+        result = {"extra": extra, "duplicates": duplicates}
         return result
 
 
 class StockImage(Stock):
     def doit(self, images_mapping: dict, dry: bool = False):
         logger.debug("Retrieving images title column ref")
-        images_column_name, images_column_id = self._get_column_ref(
-            self.drive["images_title"]
-        )
+        refs = self._prefetch([self.drive["images_title"]], load=["A"])
+        images_column_name, images_column_id = refs[self.drive["images_title"]]
 
         self._retrieve_product_ids()
-        data = []
+        batch = self._new_batch()
         for ugs, url in images_mapping.items():
             row = self.product_ids_mapping.get(ugs, None)
             if row is not None:
-                batch_entry = self._batch_element(row, images_column_id, url)
-                data.append(batch_entry)
+                batch.add(row, images_column_id, url)
             else:
                 logger.info(f"UGS ({ugs}) not found")
         if not dry:
-            result_commit = self._commit_batch(data)
+            result_commit = self._commit_batch(batch)
         else:
             result_commit = []
         return result_commit
+
+
+class StockPipeline(StockSyncer, StockCheckerID):
+    """Sync, name check and extra IDs check in a single pass.
+    The export is parsed once, the drive is read once and every write,
+    errors sheet included, is sent in one commit.
+    """
+
+    def run(self, xls_data, dry: bool = False, diff: bool = False, full=False):
+        self._start_stats()
+        self._phase("parse")
+        stock, tva = self._read_sync_stock(xls_data)
+
+        logger.info("Retrieving drive columns ref and values")
+        titles = self._sync_titles(tva) + [self.drive["name_title"]]
+        load = ["A", self.drive["cond_title"], self.drive["name_title"]]
+        errors_sheet = self.drive.get("errors_sheet", None)
+        if errors_sheet is not None:
+            load.append((errors_sheet, self.drive["missing_UGS_title"]))
+        refs = self._fetch(titles, load=load)
+
+        self._phase("transform")
+        batch = self._new_batch()
+        sync_result = self._sync_batch(
+            stock, batch, refs=refs, tva=tva, diff=diff, full=full
+        )
+        name_column_name, name_column_id = refs[self.drive["name_title"]]
+        product_names = self._retrieve_column(column_name=name_column_name)
+        id_name_keys = [self.stock["ID_title"], self.stock["name_title"]]
+        names_result = self._check_names(stock[id_name_keys], product_names)
+        extra_result = self._extra_ids(stock[[self.stock["ID_title"]]])
+        if errors_sheet is not None:
+            missing_UGS_column_name, _ = refs[
+                (errors_sheet, self.drive["missing_UGS_title"])
+            ]
+            self._error_batch(
+                batch,
+                result=sync_result,
+                previous=self._previous_errors(missing_UGS_column_name),
+            )
+
+        self._phase("commit")
+        if dry is False:
+            result_commit = self._commit_sync(batch)
+        else:
+            logger.debug("Dry run...")
+            result_commit = None
+        result = {"commit": result_commit}
+        result.update(sync_result)
+        result.update(names_result)
+        result.update(extra_result)
+        if errors_sheet is not None:
+            result["url"] = self.doc.get_sheet_URL(sheetLabel=errors_sheet)
+        result["stats"] = self._stats()
+        return result
+
+
+class StockFanOut(object):
+    """Sync of one export to several spreadsheets.
+    The export is parsed once, then every drive target is synced (and
+    its errors sheet updated) on a pool of `workers` threads. A failing
+    target doesn't stop the others.
+    """
+
+    def __init__(
+        self, *, drives: list, stock: dict, credentials, workers=None, service=None
+    ):
+        if workers is None:
+            workers = FANOUT_WORKERS
+        self.workers = workers
+        self.syncers = [
+            StockSyncer(
+                drive=drive, stock=stock, credentials=credentials, service=service
+            )
+            for drive in drives
+        ]
+
+    def _sync_target(self, syncer, stock, tva, *, dry, diff, full, errors) -> dict:
+        target = {
+            "sheetId": syncer.drive["sheetId"],
+            "sheetLabel": syncer.drive["sheetLabel"],
+        }
+        try:
+            target["result"] = syncer.sync_stock(
+                stock, tva, dry=dry, diff=diff, full=full
+            )
+            if errors is True and "errors_sheet" in syncer.drive:
+                target["errors"] = syncer.update_error(result=target["result"])
+            target["status"] = "done"
+        except Exception as e:
+            logger.error(f"Sync of {target['sheetId']} failed: {e}")
+            target["status"] = "failed"
+            target["error"] = str(e)
+        return target
+
+    def sync(
+        self,
+        xls_data,
+        dry: bool = False,
+        diff: bool = False,
+        full: bool = False,
+        errors: bool = True,
+    ) -> dict:
+        """Returns {"targets": [...]}, one entry per drive target in order
+        with its status and either the sync "result" (and "errors" sheet
+        update) or the "error" message.
+        """
+        start = time.perf_counter()
+        stock, tva = self.syncers[0]._read_sync_stock(xls_data)
+        parse = time.perf_counter() - start
+        with ThreadPoolExecutor(
+            max_workers=min(self.workers, len(self.syncers))
+        ) as executor:
+            futures = [
+                executor.submit(
+                    self._sync_target,
+                    syncer,
+                    stock,
+                    tva,
+                    dry=dry,
+                    diff=diff,
+                    full=full,
+                    errors=errors,
+                )
+                for syncer in self.syncers
+            ]
+            targets = [future.result() for future in futures]
+        return {
+            "targets": targets,
+            "stats": {
+                "timings": {
+                    "parse": parse,
+                    "targets": time.perf_counter() - start - parse,
+                }
+            },
+        }
@@ -0,0 +1,135 @@
+"""Pooled HTTP transport of the Google API clients.
+
+SessionHttp implements the httplib2.Http interface expected by
+googleapiclient over a requests session: connections are kept alive in a
+thread-safe pool, large request bodies are gzipped and responses are
+accepted compressed.
+"""
+import gzip
+import os
+import threading
+
+import httplib2
+import requests
+from google.auth.transport.requests import AuthorizedSession
+from requests.adapters import HTTPAdapter
+
+import logging
+
+logger = logging.getLogger("syncer")
+
+# (connect, read) timeouts in seconds
+HTTP_TIMEOUT = (
+    float(os.getenv("STOCK_HTTP_CONNECT_TIMEOUT", 10)),
+    float(os.getenv("STOCK_HTTP_READ_TIMEOUT", 120)),
+)
+# request bodies of at least GZIP_MIN_BYTES are compressed, 0 disables it
+GZIP_MIN_BYTES = int(os.getenv("STOCK_GZIP_MIN_BYTES", 64 * 1024))
+# connections kept per host
+POOL_SIZE = 10
+# errors worth retrying the request for
+TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout)
+
+# words of a 400 error message blaming the request body compression
+_ENCODING_ERRORS = ("gzip", "content-encoding", "compress")
+
+# headers describing the raw body, not what requests hands back
+_DECODED_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+
+class SessionHttp(object):
+    """httplib2.Http compatible wrapper of a requests session, safe to
+    share between threads. Requests are authorized (and credentials
+    refreshed) by google-auth when `credentials` are given.
+    """
+
+    def __init__(
+        self, credentials=None, *, timeout=None, gzip_min_bytes=None, pool_size=None
+    ):
+        if timeout is None:
+            timeout = HTTP_TIMEOUT
+        if gzip_min_bytes is None:
+            gzip_min_bytes = GZIP_MIN_BYTES
+        if pool_size is None:
+            pool_size = POOL_SIZE
+        if credentials is not None:
+            self.session = AuthorizedSession(credentials)
+        else:
+            self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.timeout = timeout
+        self.gzip_min_bytes = gzip_min_bytes
+
+    def _send(self, uri, method, body, headers):
+        response = self.session.request(
+            method,
+            uri,
+            data=body,
+            headers=headers,
+            timeout=self.timeout,
+            allow_redirects=True,
+        )
+        info = {
+            key.lower(): value
+            for key, value in response.headers.items()
+            if key.lower() not in _DECODED_HEADERS
+        }
+        info["status"] = str(response.status_code)
+        resp = httplib2.Response(info)
+        resp.reason = response.reason
+        return resp, response.content
+
+    def request(
+        self,
+        uri,
+        method="GET",
+        body=None,
+        headers=None,
+        redirections=httplib2.DEFAULT_MAX_REDIRECTS,
+        connection_type=None,
+    ):
+        headers = dict(headers or {})
+        headers.setdefault("accept-encoding", "gzip")
+        if (
+            body is not None
+            and self.gzip_min_bytes > 0
+            and len(body) >= self.gzip_min_bytes
+        ):
+            raw = body.encode("utf-8") if isinstance(body, str) else body
+            compressed = dict(headers, **{"content-encoding": "gzip"})
+            resp, content = self._send(uri, method, gzip.compress(raw), compressed)
+            if not _encoding_refused(resp, content):
+                return resp, content
+            # the endpoint doesn't take compressed bodies, stop trying
+            logger.warning(f"Compressed request refused ({resp.status}), disabled")
+            self.gzip_min_bytes = 0
+        return self._send(uri, method, body, headers)
+
+
+def _encoding_refused(resp, content) -> bool:
+    """Whether an answer refuses the compression rather than the request:
+    415, or 400 blaming the encoding. Other errors are answered as is.
+    """
+    if resp.status == 415:
+        return True
+    if resp.status != 400:
+        return False
+    message = content.decode("utf-8", errors="replace").lower()
+    return any(word in message for word in _ENCODING_ERRORS)
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def session_http(credentials) -> SessionHttp:
+    """SessionHttp shared by every document using `credentials`."""
+    key = id(credentials)
+    with _sessions_lock:
+        session = _sessions.get(key, None)
+        if session is None or session[0] is not credentials:
+            session = (credentials, SessionHttp(credentials))
+            _sessions[key] = session
+        return session[1]
@@ -0,0 +1,125 @@
+"""Watch a folder for new stock exports.
+
+A new or rewritten export is reported once its size and modification time
+have been stable for `debounce` seconds, so that files still being copied
+are never read half written. The watcher is woken up by inotify when
+inotify_simple is installed, the folder is polled otherwise.
+"""
+import os
+import time
+
+import logging
+
+logger = logging.getLogger("syncer")
+
+EXPORT_SUFFIXES = (".xls", ".xlsx", ".ods", ".csv")
+# reports are written next to the exports, see report_path
+REPORT_SUFFIX = ".report.xlsx"
+ERROR_SUFFIX = ".error.txt"
+# seconds an export must stay unchanged before being synced
+DEBOUNCE = 2.0
+# seconds between two scans of the folder without inotify
+POLL_INTERVAL = 1.0
+
+
+def report_path(path: str) -> str:
+    return os.path.splitext(path)[0] + REPORT_SUFFIX
+
+
+def error_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ERROR_SUFFIX
+
+
+def is_export(name: str) -> bool:
+    # office lock files (~$) and hidden partial copies are left out
+    if name.startswith((".", "~$")) or name.endswith(REPORT_SUFFIX):
+        return False
+    return name.lower().endswith(EXPORT_SUFFIXES)
+
+
+class FolderWatcher(object):
+    """Exports of `directory` ready to be synced, see poll and watch."""
+
+    def __init__(
+        self, directory: str, *, debounce=DEBOUNCE, poll_interval=POLL_INTERVAL
+    ):
+        self.directory = directory
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        # {path: (size, mtime)} of the exports already reported
+        self._seen = {}
+        # {path: ((size, mtime), first seen with this state)}
+        self._pending = {}
+        self._inotify = self._open_inotify()
+
+    def _open_inotify(self):
+        try:
+            from inotify_simple import INotify, flags
+        except ImportError:
+            logger.info(f"inotify_simple is not available, polling {self.directory}")
+            return None
+        inotify = INotify()
+        inotify.add_watch(
+            self.directory,
+            flags.CREATE | flags.MODIFY | flags.CLOSE_WRITE | flags.MOVED_TO,
+        )
+        return inotify
+
+    def _scan(self) -> dict:
+        states = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not is_export(entry.name):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.is_file():
+                    states[entry.path] = (stat.st_size, stat.st_mtime_ns)
+        return states
+
+    def mark_seen(self, path: str):
+        """Don't report `path` until it changes."""
+        stat = os.stat(path)
+        self._seen[path] = (stat.st_size, stat.st_mtime_ns)
+
+    def poll(self) -> list:
+        """Exports unchanged for `debounce` seconds since they were
+        written, reported once per version.
+        """
+        now = time.monotonic()
+        states = self._scan()
+        ready = []
+        for path, state in states.items():
+            if self._seen.get(path, None) == state:
+                continue
+            pending = self._pending.get(path, None)
+            if pending is None or pending[0] != state:
+                self._pending[path] = (state, now)
+            elif now - pending[1] >= self.debounce:
+                del self._pending[path]
+                self._seen[path] = state
+                ready.append(path)
+        for path in list(self._pending):
+            if path not in states:
+                del self._pending[path]
+        return sorted(ready)
+
+    def _wait(self):
+        # wake up as soon as a pending export may be stable
+        timeout = self.debounce if self._pending else self.poll_interval
+        if self._inotify is None:
+            time.sleep(timeout)
+        elif self._pending:
+            self._inotify.read(timeout=int(timeout * 1000))
+        else:
+            # nothing pending, sleep until the folder changes
+            self._inotify.read()
+
+    def watch(self):
+        """Yield the exports ready to be synced, forever."""
+        while True:
+            for path in self.poll():
+                yield path
+            self._wait()
@@ -0,0 +1,8 @@
+#!/usr/bin/env python
+"""Same as `stock watch`, kept for existing scripts."""
+import sys
+
+from stock_cli import main
+
+if __name__ == "__main__":
+    sys.exit(main(["watch"] + sys.argv[1:]))
@@ -0,0 +1,73 @@
+"""Export readers and the export cache."""
+import io
+import os
+import sys
+
+import numpy as np
+import pytest
+import xlsxwriter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import stock_cache
+from stock_readers import read_columns
+from stock_syncer import read_stock
+
+TITLES = ["id", "qty_available", "list_price", "by_unit"]
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(stock_cache, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(stock_cache, "_export_cache", None)
+
+
+def xlsx_export(rows: list) -> bytes:
+    output = io.BytesIO()
+    workbook = xlsxwriter.Workbook(output, {"in_memory": True})
+    sheet = workbook.add_worksheet("Export")
+    sheet.write_row(0, 0, TITLES)
+    for row, line in enumerate(rows, start=1):
+        sheet.write_row(row, 0, line)
+    workbook.close()
+    return output.getvalue()
+
+
+def test_xlsx_booleans_survive_the_cache():
+    data = xlsx_export([["p1", 3, 2.5, False], ["p2", 1.5, 10, True]])
+    assert list(read_columns(data, TITLES)["by_unit"]) == [0.0, 1.0]
+
+    first = read_stock(data, TITLES)
+    assert os.listdir(stock_cache.export_cache().directory)
+    cached = read_stock(data, TITLES)
+    assert list(first["by_unit"]) == list(cached["by_unit"]) == [0.0, 1.0]
+    assert (cached["by_unit"] == 0.0).tolist() == [True, False]
+    assert first.equals(cached)
+
+
+def test_mixed_column_survives_the_cache():
+    data = xlsx_export([["p1", "N/A", 2.5, True], ["p2", 1.5, 10, "x"]])
+    first = read_stock(data, TITLES)
+    cached = read_stock(data, TITLES)
+    assert list(cached["qty_available"]) == ["N/A", 1.5]
+    assert list(cached["by_unit"]) == [1.0, "x"]
+    assert first.equals(cached)
+
+
+def test_semicolon_csv_decimal_commas():
+    data = (
+        "id;qty_available;list_price;by_unit\n"
+        "p1;1,5;12,25;0\n"
+        "p2;3;N/A;1\n"
+    ).encode("utf-8")
+    columns = read_columns(data, TITLES)
+    assert columns["qty_available"].dtype == float
+    assert list(columns["qty_available"]) == [1.5, 3.0]
+    assert list(columns["list_price"]) == [12.25, "N/A"]
+
+
+def test_comma_csv_decimal_points():
+    data = b'id,qty_available,list_price,by_unit\np1,1.5,"12,5",0\n'
+    columns = read_columns(data, TITLES)
+    assert list(columns["qty_available"]) == [1.5]
+    assert np.array_equal(columns["by_unit"], [0.0])
@@ -0,0 +1,379 @@
+"""Syncs against the Sheets emulator, on the synthetic benchmark exports."""
+import os
+import sys
+from math import floor, isnan
+
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import stock_cache
+from generate_export import (
+    DRIVE_CONFIG,
+    ERRORS_TITLES,
+    STOCK_CONFIG,
+    generate_drive,
+    generate_export,
+)
+from sheets_emulator import SheetsEmulator
+from stock_syncer import (
+    MASS_RE,
+    PRODUCT_ID_PREFIX,
+    SYNC_STATE_COLUMNS,
+    TVA_VALUE_MAPPING,
+    BatchUpdate,
+    StockSyncer,
+    quantity_price_values,
+    rowcol_to_a1,
+    sync_delta,
+)
+
+ROWS = 400
+# columns of generate_drive
+STOCK, PRICE, QUANTITY_PRICE, COND, TVA = 2, 3, 4, 5, 6
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(stock_cache, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(stock_cache, "EXPORT_CACHE_SIZE", 0)
+
+
+@pytest.fixture(scope="module")
+def export():
+    return generate_export(ROWS)
+
+
+def new_emulator() -> SheetsEmulator:
+    emulator = SheetsEmulator()
+    emulator.add_sheet(
+        DRIVE_CONFIG["sheetId"], DRIVE_CONFIG["sheetLabel"], generate_drive(ROWS)
+    )
+    emulator.add_sheet(
+        DRIVE_CONFIG["sheetId"], DRIVE_CONFIG["errors_sheet"], [ERRORS_TITLES]
+    )
+    return emulator
+
+
+def new_syncer(emulator, **drive) -> StockSyncer:
+    return StockSyncer(
+        drive=dict(DRIVE_CONFIG, **drive),
+        stock=STOCK_CONFIG,
+        credentials=None,
+        service=emulator,
+    )
+
+
+def stock_cells(emulator) -> dict:
+    sheet = emulator.sheet(DRIVE_CONFIG["sheetId"], DRIVE_CONFIG["sheetLabel"])
+    return dict(sheet.cells)
+
+
+def conditionings(syncer) -> list:
+    column_name, _ = syncer._get_column_ref(DRIVE_CONFIG["cond_title"])
+    return syncer._retrieve_column(column_name)
+
+
+def as_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def baseline_updates(stock, mapping: dict, product_cond: list) -> (dict, list):
+    """Cell updates of the row by row loop StockSyncer.sync ran before it
+    was vectorized, and its missing IDs. A missing conditioning reads as
+    empty, the loop reused the one of the previous line.
+    """
+    updates = {}
+    missing_ids = []
+    for elem in stock.values:
+        product_qty = as_number(elem[1])
+        product_price = as_number(elem[2])
+        if not isinstance(elem[0], str) or isnan(product_qty) or isnan(product_price):
+            continue
+        product_id = elem[0].replace(PRODUCT_ID_PREFIX, "")
+        row = mapping.get(product_id, None)
+        if row is None:
+            if product_qty > 0:
+                missing_ids.append({"id": product_id, "name": elem[3]})
+            continue
+        cond = product_cond[row] if row < len(product_cond) else None
+        price_cell = rowcol_to_a1(row, PRICE)
+        quantity_price_cell = rowcol_to_a1(row, QUANTITY_PRICE)
+        cond_cell = rowcol_to_a1(row, COND)
+        if elem[4] == 0.0:
+            updates[(row, STOCK)] = product_qty
+            updates[(row, PRICE)] = product_price
+            updates[(row, QUANTITY_PRICE)] = (
+                f"=IFERROR(ROUND({price_cell} * 1000 / VALUE(REGEXEXTRACT("
+                f'{cond_cell}; "^\\s*[0-9]+")); 2); "N/A")'
+            )
+        else:
+            match = MASS_RE.match(cond or "")
+            if match is None or int(match.group("mass")) == 0:
+                continue
+            mass = int(match.group("mass"))
+            updates[(row, STOCK)] = max(floor(product_qty * 1000 / mass), 0)
+            updates[(row, PRICE)] = (
+                f"={quantity_price_cell} * VALUE(REGEXEXTRACT("
+                f'{cond_cell}; "^\\s*[0-9]+")) / 1000'
+            )
+            updates[(row, QUANTITY_PRICE)] = product_price
+        # the loop read the TVA code from the name column (elem[3])
+        if elem[3] in TVA_VALUE_MAPPING:
+            updates[(row, TVA)] = TVA_VALUE_MAPPING[elem[3]]
+    missing_ids.sort(key=lambda elem: int(elem["id"]))
+    return updates, missing_ids
+
+
+def test_transform_matches_baseline_loop(export):
+    emulator = new_emulator()
+    before = stock_cells(emulator)
+    syncer = new_syncer(emulator)
+    result = syncer.sync(export)
+
+    stock, tva = syncer._read_sync_stock(export)
+    assert tva is True
+    product_cond = conditionings(syncer)
+    updates, missing_ids = baseline_updates(
+        stock, syncer.product_ids_mapping, product_cond
+    )
+    assert result["missing_ids"] == missing_ids
+
+    expected = dict(before)
+    for (row, col), value in updates.items():
+        expected[(row + 1, col)] = value
+    after = stock_cells(emulator)
+    for cell in set(expected) | set(after):
+        if cell[1] == TVA:
+            continue
+        value = after.get(cell, None)
+        if isinstance(expected.get(cell, None), str):
+            assert value == expected[cell], cell
+        else:
+            assert value == pytest.approx(expected.get(cell, None)), cell
+
+    # the only difference: TVA codes now come from the TVA column
+    assert not any(col == TVA for _, col in updates)
+    ids = stock.iloc[:, 0].str.replace(PRODUCT_ID_PREFIX, "", regex=False)
+    updated = {row for row, col in updates if col == STOCK}
+    tva_codes = {}
+    for product_id, code in zip(ids, stock.iloc[:, 5]):
+        row = syncer.product_ids_mapping.get(product_id, None)
+        if row in updated and code in TVA_VALUE_MAPPING:
+            tva_codes[(row + 1, TVA)] = TVA_VALUE_MAPPING[code]
+    assert tva_codes
+    written = {cell: v for cell, v in after.items() if cell[1] == TVA and cell[0] > 0}
+    assert written == tva_codes
+
+
+def test_batch_update_coalesces_adjacent_rows():
+    batch = BatchUpdate(sheetLabel="Stock")
+    for row in [0, 2, 1, 5]:
+        batch.add(row, 2, row * 10)
+    batch.add(3, 0, "x", sheetLabel="Erreurs")
+    batch.add_many(pd.Series([7, 6]), 2, pd.Series([70, 60]))
+    # rows are overwritten, not added twice
+    batch.add(1, 2, 11)
+
+    assert len(batch) == 7
+    assert batch.data() == [
+        {"range": "Stock!C2:C4", "majorDimension": "COLUMNS", "values": [[0, 11, 20]]},
+        {
+            "range": "Stock!C7:C9",
+            "majorDimension": "COLUMNS",
+            "values": [[50, 60, 70]],
+        },
+        {"range": "Erreurs!A5", "majorDimension": "COLUMNS", "values": [["x"]]},
+    ]
+    assert batch.drop_rows([0, 1, 2, 3]) == 3
+    assert [value_range["range"] for value_range in batch.data()] == [
+        "Stock!C7:C9",
+        "Erreurs!A5",
+    ]
+
+
+def test_diff_mode_skips_unchanged_cells(export):
+    emulator = new_emulator()
+    first = new_syncer(emulator).sync(export)
+    assert first["changed"] > 0
+
+    emulator.reset_counters()
+    result = new_syncer(emulator).sync(export, diff=True)
+    assert result["changed"] == 0
+    assert result["unchanged"] == first["changed"]
+    assert "values.batchUpdate" not in emulator.stats()["calls"]
+
+    sheet = emulator.sheet(DRIVE_CONFIG["sheetId"], DRIVE_CONFIG["sheetLabel"])
+    cell = next(
+        cell for cell in sorted(sheet.cells) if cell[0] > 0 and cell[1] == STOCK
+    )
+    written = sheet.cells[cell]
+    sheet.set(*cell, -1)
+    result = new_syncer(emulator).sync(export, diff=True)
+    assert result["changed"] == 1
+    assert sheet.cells[cell] == written
+
+
+def test_sync_delta():
+    def state(lines):
+        return pd.DataFrame(lines, columns=["id"] + SYNC_STATE_COLUMNS)
+
+    previous = state(
+        [
+            ["1", 0, 2.0, 1.5, True, "", "250g"],
+            ["2", 1, 3.0, 2.5, False, "", "500g"],
+            ["3", 2, 4.0, 3.5, True, "", "pièce"],
+        ]
+    )
+    current = state(
+        [
+            ["1", 0, 2.0, 1.5, True, "", "250g"],
+            ["2", 1, 3.0, 2.0, False, "", "500g"],
+            ["4", 3, 1.0, 1.0, True, "", "1000g"],
+        ]
+    )
+    assert sync_delta(previous, current) == {
+        "new": ["4"],
+        "changed": ["2"],
+        "unchanged": ["1"],
+        "disappeared": ["3"],
+    }
+
+
+def test_incremental_sync_sends_changed_products(export):
+    emulator = new_emulator()
+    first = new_syncer(emulator, incremental=True).sync(export)
+    assert first["delta"] is None
+
+    result = new_syncer(emulator, incremental=True).sync(export)
+    assert result["changed"] == 0
+    assert result["delta"]["new"] == result["delta"]["changed"] == []
+    assert result["delta"]["unchanged"] > 0
+
+
+@pytest.mark.parametrize("strategy", ["formula", "array", "value"])
+def test_formula_strategies(export, strategy):
+    emulator = new_emulator()
+    syncer = new_syncer(emulator, formula_strategy=strategy)
+    syncer.sync(export)
+    after = stock_cells(emulator)
+
+    stock, _ = syncer._read_sync_stock(export)
+    product_cond = conditionings(syncer)
+    updates, _ = baseline_updates(stock, syncer.product_ids_mapping, product_cond)
+    unit_rows = [
+        row
+        for (row, col), value in updates.items()
+        if col == QUANTITY_PRICE and isinstance(value, str)
+    ]
+    weight_rows = [
+        row
+        for (row, col), value in updates.items()
+        if col == PRICE and isinstance(value, str)
+    ]
+    assert unit_rows and weight_rows
+
+    quantity_prices = {
+        row: value for (row, col), value in after.items() if col == QUANTITY_PRICE
+    }
+    # stock is the same whatever the strategy
+    for (row, col), value in updates.items():
+        if col == STOCK:
+            assert after[(row + 1, STOCK)] == pytest.approx(value)
+
+    if strategy == "formula":
+        for (row, col), value in updates.items():
+            if col != TVA:
+                assert after.get((row + 1, col), None) == pytest.approx(value)
+    elif strategy == "array":
+        # a single formula in the first row, the column is cleared below
+        formula = quantity_prices.pop(1)
+        assert formula.startswith("=ARRAYFORMULA(")
+        assert quantity_prices == {0: DRIVE_CONFIG["quantity_price_title"]}
+        for row in unit_rows:
+            assert isinstance(after[(row + 1, PRICE)], float)
+        for row in weight_rows:
+            assert isinstance(after[(row + 1, PRICE)], float)
+    else:
+        written = [
+            value
+            for (_, col), value in after.items()
+            if col in (PRICE, QUANTITY_PRICE)
+        ]
+        assert not any(str(value).startswith("=") for value in written)
+        prices = pd.Series([updates[(row, PRICE)] for row in unit_rows])
+        conds = pd.Series([product_cond[row] for row in unit_rows], dtype=object)
+        expected = quantity_price_values(prices, conds).tolist()
+        assert [after.get((row + 1, QUANTITY_PRICE), None) for row in unit_rows] == (
+            expected
+        )
+        for row in weight_rows:
+            mass = int(MASS_RE.match(product_cond[row]).group("mass"))
+            price = updates[(row, QUANTITY_PRICE)]
+            assert after[(row + 1, PRICE)] == pytest.approx(price * mass / 1000)
+            assert after[(row + 1, QUANTITY_PRICE)] == pytest.approx(price)
+
+
+def test_snapshot_survives_our_writes(export):
+    emulator = new_emulator()
+    new_syncer(emulator, snapshot=True).sync(export)
+
+    emulator.reset_counters()
+    result = new_syncer(emulator, snapshot=True).sync(export)
+    calls = emulator.stats()["calls"]
+    # title rows, IDs and conditionings come from the snapshot
+    assert "values.get" not in calls and "values.batchGet" not in calls
+    assert calls["values.batchUpdate"] == 1
+    assert result["changed"] > 0
+
+    # an edit made between our reads and our writes is never hidden by the
+    # snapshot
+    def edit(phase):
+        if phase == "commit":
+            emulator.spreadsheets().values().batchUpdate(
+                spreadsheetId=DRIVE_CONFIG["sheetId"],
+                body={
+                    "valueInputOption": "RAW",
+                    "data": [{"range": "Stock!F2", "values": [["9999g"]]}],
+                },
+            ).execute()
+
+    syncer = new_syncer(emulator, snapshot=True)
+    syncer.progress = edit
+    syncer.sync(export)
+    emulator.reset_counters()
+    new_syncer(emulator, snapshot=True).sync(export)
+    assert "values.batchGet" in emulator.stats()["calls"]
+
+
+def test_update_error_blanks_previous_entries_only(export):
+    emulator = new_emulator()
+    errors = emulator.sheet(DRIVE_CONFIG["sheetId"], DRIVE_CONFIG["errors_sheet"])
+    syncer = new_syncer(emulator)
+    result = syncer.sync(export)
+    missing_ids = result["missing_ids"]
+    assert len(missing_ids) > 2
+
+    # the errors column was prefetched by the sync
+    emulator.reset_counters()
+    update = syncer.update_error(result=result)
+    assert emulator.stats()["calls"] == {
+        "spreadsheets.get": 1,
+        "values.batchUpdate": 1,
+    }
+    assert update["commit"]["totalUpdatedCells"] == len(missing_ids) + 1
+    assert max(row for row, _ in errors.cells) == len(missing_ids) + 1
+
+    syncer = new_syncer(emulator)
+    result = syncer.sync(export, dry=True)
+    result["missing_ids"] = missing_ids[:2]
+    update = syncer.update_error(result=result)
+    # date, 2 missing IDs and the blanked leftovers of the previous run
+    assert update["commit"]["totalUpdatedCells"] == len(missing_ids) + 1
+    assert sorted(errors.cells) == [(0, 0), (1, 0), (2, 0), (3, 0)]
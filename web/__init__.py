@@ -1,5 +1,4 @@
 import os
-import pickle
 from configparser import ConfigParser
 import logging
 
@@ -13,10 +12,9 @@ root.addHandler(default_handler)
 MAIN_DIR = os.path.dirname(os.path.dirname(__file__))
 
 def retrieve_configuration():
-    creds = None
+    from .credentials import CredentialsManager
     config_dir = os.getenv('CONFIG_DIR', MAIN_DIR)
-    with open(f'{config_dir}/token.pickle', 'rb') as token:
-        creds = pickle.load(token)
+    creds = CredentialsManager(f'{config_dir}/token.pickle')
     # The ID and range of a sample spreadsheet (retrieve from config)
     root.debug("Reading configuration")
     parser = ConfigParser()
@@ -36,6 +34,10 @@ def retrieve_configuration():
     drive['quantity_price_title'] = parser.get('drive', 'quantity_price_title')
     drive['cond_title'] = parser.get('drive', 'cond_title')
     drive['dry_run'] = parser.getboolean('drive', 'dry_run', fallback=False)
+    drive['diff'] = parser.getboolean('drive', 'diff', fallback=False)
+    drive['snapshot'] = parser.getboolean('drive', 'snapshot', fallback=False)
+    drive['incremental'] = parser.getboolean('drive', 'incremental', fallback=False)
+    drive['formula_strategy'] = parser.get('drive', 'formula_strategy', fallback='formula')
     
     drive["errors_sheet"] = parser.get("drive", "errors_sheet_label")
     drive["missing_UGS_title"] = parser.get("drive", "missing_UGS_title")
@@ -54,9 +56,14 @@ def create_app():
     app.config['ROB_DRIVE'] = drive
     app.config['ROB_STOCK'] = stock
     app.config['ROB_CREDS'] = creds
+    # uploads above this size are refused (413)
+    app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_UPLOAD_MB', '32')) * 1024 * 1024
 
     from .models import db
     db.init_app(app)
+    with app.app_context():
+        # create missing tables (jobs)
+        db.create_all()
 
     login_manager = LoginManager()
     login_manager.login_view = 'auth.login'
@@ -77,4 +84,8 @@ def create_app():
     from .main import main as main_blueprint
     app.register_blueprint(main_blueprint)
 
+    # prometheus metrics, not behind login
+    from .metrics import metrics as metrics_blueprint
+    app.register_blueprint(metrics_blueprint)
+
     return app
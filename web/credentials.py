@@ -0,0 +1,108 @@
+import fcntl
+import os
+import pickle
+import threading
+import time
+from datetime import datetime, timedelta
+
+from google.auth.transport.requests import Request
+
+import logging
+
+logger = logging.getLogger("credentials")
+
+# tokens are refreshed this long before they expire
+REFRESH_MARGIN = timedelta(minutes=5)
+# seconds between two checks of the background thread
+CHECK_INTERVAL = 60
+
+
+class CredentialsManager(object):
+    """Google credentials stored in a token.pickle file, refreshed in the
+    background before they expire.
+    A refresh holds an exclusive lock on `<token>.lock` so that a single
+    uwsgi worker refreshes at a time; the token is then written
+    atomically and picked up by the other workers. The credentials object
+    is updated in place, clients built on it keep working.
+    """
+
+    def __init__(self, token_path: str):
+        self.token_path = token_path
+        self.lock_path = f"{token_path}.lock"
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._thread_pid = None
+        self.credentials = self._load()
+
+    def _load(self):
+        with open(self.token_path, "rb") as token:
+            self._mtime = os.fstat(token.fileno()).st_mtime
+            return pickle.load(token)
+
+    def _reload(self):
+        """Take the token written by another process, if any."""
+        try:
+            mtime = os.stat(self.token_path).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        stored = self._load()
+        self.credentials.token = stored.token
+        self.credentials.expiry = stored.expiry
+        logger.debug("Credentials reloaded")
+
+    def _expiring(self) -> bool:
+        expiry = self.credentials.expiry
+        if expiry is None:
+            return not self.credentials.valid
+        # google-auth expiries are naive UTC datetimes
+        return expiry - datetime.utcnow() < REFRESH_MARGIN
+
+    def _save(self):
+        tmp_path = f"{self.token_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as token:
+            pickle.dump(self.credentials, token)
+        os.replace(tmp_path, self.token_path)
+        self._mtime = os.stat(self.token_path).st_mtime
+
+    def refresh(self, force: bool = False):
+        """Refresh the credentials if they expire soon (or `force`)."""
+        with self._lock:
+            with open(self.lock_path, "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    self._reload()
+                    if not force and not self._expiring():
+                        return
+                    if not self.credentials.refresh_token:
+                        logger.error("Credentials can't be refreshed")
+                        return
+                    logger.info("Refreshing credentials")
+                    self.credentials.refresh(Request())
+                    self._save()
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Credentials refresh failed: {e}")
+            time.sleep(CHECK_INTERVAL)
+
+    def get(self):
+        """Valid credentials, refreshed synchronously only if the
+        background thread couldn't keep up.
+        """
+        # started on first use so that each uwsgi worker gets its thread
+        if self._thread_pid != os.getpid():
+            with self._lock:
+                if self._thread_pid != os.getpid():
+                    self._thread_pid = os.getpid()
+                    threading.Thread(target=self._run, daemon=True).start()
+        self._reload()
+        if not self.credentials.valid:
+            self.refresh()
+        return self.credentials
@@ -0,0 +1,113 @@
+import json
+import os
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from stock_syncer import StockSyncer
+
+from .metrics import record_job, record_stats
+from .models import Job, db
+
+import logging
+
+logger = logging.getLogger("jobs")
+
+# Phases reported by StockSyncer, in order
+PHASES = ["parse", "refs", "fetch", "transform", "commit", "errors"]
+# Uploaded exports are spooled there until their job is done
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", tempfile.gettempdir())
+
+_executor = None
+_executor_lock = Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    # created on first use so that each uwsgi worker gets its own threads
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = int(os.getenv("JOB_WORKERS", "2"))
+            _executor = ThreadPoolExecutor(max_workers=workers)
+        return _executor
+
+
+def create_job(user_id, filename) -> Job:
+    job = Job(id=uuid.uuid4().hex, user_id=user_id, filename=filename,
+              status="queued", progress=0)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def spool_upload(storage) -> str:
+    """Copy an uploaded file by chunks to a temporary file of UPLOAD_DIR,
+    removed by run_upload. Returns its path.
+    """
+    fd, path = tempfile.mkstemp(prefix="upload-", dir=UPLOAD_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            storage.save(f)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+def interrupt_jobs():
+    """Jobs still queued or running when the application starts were lost."""
+    jobs = Job.query.filter(Job.status.in_(["queued", "running"])).all()
+    for job in jobs:
+        job.status = "failed"
+        job.error = "Interrupted"
+    db.session.commit()
+
+
+def _update_job(job_id, **kwargs):
+    job = Job.query.get(job_id)
+    for key, value in kwargs.items():
+        setattr(job, key, value)
+    db.session.commit()
+
+
+def run_upload(app, job_id, xls_path, drive, stock, creds):
+    with app.app_context():
+        def progress(phase):
+            done = PHASES.index(phase) if phase in PHASES else 0
+            _update_job(job_id, phase=phase,
+                        progress=int(done * 100 / len(PHASES)))
+
+        start = time.perf_counter()
+        try:
+            _update_job(job_id, status="running")
+            stockSyncer = StockSyncer(drive=drive, stock=stock,
+                                      credentials=creds, progress=progress)
+            result = stockSyncer.sync(xls_path, dry=drive["dry_run"],
+                                      diff=drive["diff"])
+            logger.debug("Call stockSyncer update error")
+            errors = stockSyncer.update_error(result=result)
+            record_stats(result["stats"])
+            record_stats(errors["stats"])
+            payload = {
+                "missing_ids": result["missing_ids"],
+                "missing_conditioning": result["missing_conditioning"],
+                "stats": result["stats"],
+            }
+            _update_job(job_id, status="done", phase=None, progress=100,
+                        result=json.dumps(payload))
+            record_job("done", time.perf_counter() - start)
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            db.session.rollback()
+            _update_job(job_id, status="failed", error=str(e))
+            record_job("failed", time.perf_counter() - start)
+        finally:
+            db.session.remove()
+            os.remove(xls_path)
+
+
+def submit_upload(app, job_id, xls_path, drive, stock, creds):
+    return get_executor().submit(run_upload, app, job_id, xls_path,
+                                 drive, stock, creds)
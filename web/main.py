@@ -1,11 +1,13 @@
-from stock_syncer import StockSyncer
+import json
 import os
 from random import randrange
 
 from flask import Blueprint, render_template, current_app, request, jsonify
 from flask_login import login_required, current_user
+from werkzeug.exceptions import RequestEntityTooLarge
 
-from google.auth.transport.requests import Request
+from .jobs import create_job, spool_upload, submit_upload
+from .models import Job
 
 import logging
 
@@ -61,33 +63,55 @@ def upload_xls():
     drive = current_app.config["ROB_DRIVE"]
     stock = current_app.config["ROB_STOCK"]
     creds = current_app.config["ROB_CREDS"]
-    dry_run = drive["dry_run"]
     if request.files:
         try:
             xls = request.files["xls"]
-            xls_data = xls.read()
-            # refresh creds is needed
-            if not creds.valid:
-                logger.warning("Invalid creds")
-                if creds.expired and creds.refresh_token:
-                    logger.info("Try to refresh credentials")
-                    creds.refresh(Request())
-                    # readd in config
-                    current_app.config["ROB_CREDS"] = creds
-                else:
-                    logger.error("Invalid credentials")
-                    return (
-                        jsonify(
-                            {"image": get_failed(), "error": "Invalid credentials"}
-                        ),
-                        500,
-                    )
-            stockSyncer = StockSyncer(drive=drive, stock=stock, credentials=creds)
-            result = stockSyncer.sync(xls_data, dry=dry_run)
-            logger.debug("Call stockSyncer update error")
-            stockSyncer.update_error(result=result)
+            # refreshed in background by the credentials manager
+            if not creds.get().valid:
+                logger.error("Invalid credentials")
+                return (
+                    jsonify({"image": get_failed(), "error": "Invalid credentials"}),
+                    500,
+                )
+            # written to disk, the job reads it memory-mapped
+            xls_path = spool_upload(xls)
+            try:
+                job = create_job(current_user.id, xls.filename)
+                app = current_app._get_current_object()
+                submit_upload(app, job.id, xls_path, drive, stock, creds.get())
+            except Exception:
+                os.remove(xls_path)
+                raise
         except Exception as e:
             logger.error(f"Exception: {e}")
             return jsonify({"image": get_failed(), "error": str(e)}), 500
-        return jsonify({"image": get_ok(), "missing_ids": result["missing_ids"]})
+        return jsonify({"job": job.id}), 202
     return jsonify({"image": get_failed(), "error": "Missing file"}), 403
+
+
+@main.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    limit = current_app.config["MAX_CONTENT_LENGTH"]
+    error = f"File too large (more than {limit // (1024 * 1024)} MB)"
+    return jsonify({"image": get_failed(), "error": error}), 413
+
+
+@main.route("/jobs/<job_id>")
+@login_required
+def job_status(job_id):
+    job = Job.query.get(job_id)
+    if job is None or job.user_id != current_user.id:
+        return jsonify({"error": "Unknown job"}), 404
+    response = {
+        "job": job.id,
+        "status": job.status,
+        "phase": job.phase,
+        "progress": job.progress,
+    }
+    if job.status == "done":
+        response.update(json.loads(job.result))
+        response["image"] = get_ok()
+    elif job.status == "failed":
+        response["error"] = job.error
+        response["image"] = get_failed()
+    return jsonify(response)
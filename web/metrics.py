@@ -0,0 +1,102 @@
+"""Prometheus metrics of the upload jobs.
+
+Metrics are kept in memory, per process: with several uwsgi workers each
+one exposes its own counters.
+"""
+from collections import Counter
+from threading import Lock
+
+from flask import Blueprint, Response
+
+# upper bounds (seconds) of the phase and job duration histograms
+BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+
+API_COUNTERS = {
+    "calls": ("stock_sync_api_calls_total", "Sheets API calls"),
+    "retries": ("stock_sync_api_retries_total", "Sheets API calls retried"),
+    "request_bytes": (
+        "stock_sync_api_request_bytes_total",
+        "Sheets API request bytes",
+    ),
+    "response_bytes": (
+        "stock_sync_api_response_bytes_total",
+        "Sheets API response bytes",
+    ),
+    "cells": ("stock_sync_cells_written_total", "Spreadsheet cells written"),
+}
+
+_lock = Lock()
+_jobs = Counter()
+_api = Counter()
+# {(histogram, phase): [bucket counts..., count, sum]}
+_histograms = {}
+
+
+def _observe(name, label, value):
+    counts = _histograms.setdefault((name, label), [0] * (len(BUCKETS) + 2))
+    for i, bound in enumerate(BUCKETS):
+        if value <= bound:
+            counts[i] += 1
+    counts[-2] += 1
+    counts[-1] += value
+
+
+def record_stats(stats: dict):
+    """Add the "stats" of a StockSyncer result."""
+    with _lock:
+        for phase, duration in stats["timings"].items():
+            _observe("stock_sync_phase_seconds", phase, duration)
+        _api.update(stats["api"])
+
+
+def record_job(status: str, duration: float):
+    with _lock:
+        _jobs[status] += 1
+        _observe("stock_sync_job_seconds", None, duration)
+
+
+def _histogram_lines(name, label, counts) -> list:
+    labels = f'phase="{label}",' if label is not None else ""
+    lines = [
+        f'{name}_bucket{{{labels}le="{bound}"}} {count}'
+        for bound, count in zip(BUCKETS, counts)
+    ]
+    lines.append(f'{name}_bucket{{{labels}le="+Inf"}} {counts[-2]}')
+    labels = f"{{{labels[:-1]}}}" if labels else ""
+    lines.append(f"{name}_count{labels} {counts[-2]}")
+    lines.append(f"{name}_sum{labels} {counts[-1]}")
+    return lines
+
+
+def render() -> str:
+    lines = [
+        "# HELP stock_sync_jobs_total Upload jobs by final status",
+        "# TYPE stock_sync_jobs_total counter",
+    ]
+    with _lock:
+        for status, count in sorted(_jobs.items()):
+            lines.append(f'stock_sync_jobs_total{{status="{status}"}} {count}')
+        for key, (name, description) in API_COUNTERS.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {_api[key]}")
+        for name, description in [
+            ("stock_sync_phase_seconds", "Duration of the sync phases"),
+            ("stock_sync_job_seconds", "Duration of the upload jobs"),
+        ]:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} histogram")
+            for (histogram, label), counts in sorted(
+                _histograms.items(), key=lambda item: str(item[0])
+            ):
+                if histogram == name:
+                    lines += _histogram_lines(name, label, counts)
+    return "\n".join(lines) + "\n"
+
+
+metrics = Blueprint("metrics", __name__)
+
+
+@metrics.route("/metrics")
+def metrics_route():
+    return Response(render(), mimetype="text/plain; version=0.0.4")
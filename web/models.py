@@ -1,3 +1,4 @@
+from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 
@@ -9,3 +10,15 @@ class User(UserMixin, db.Model):
     email = db.Column(db.String(100), unique=True)
     password = db.Column(db.String(100))
     name = db.Column(db.String(1000))
+
+class Job(db.Model):
+    id = db.Column(db.String(32), primary_key=True) # uuid4 hex, not guessable
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    filename = db.Column(db.String(1000))
+    status = db.Column(db.String(20), default='queued') # queued, running, done, failed
+    phase = db.Column(db.String(20))
+    progress = db.Column(db.Integer, default=0)
+    result = db.Column(db.Text) # JSON encoded sync result
+    error = db.Column(db.Text)
+    created = db.Column(db.DateTime, default=datetime.utcnow)
+    updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
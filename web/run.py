@@ -1,3 +1,9 @@
 from  . import create_app
+from .jobs import interrupt_jobs
 
 app = create_app()
+
+# only the server started by uwsgi owns the queued and running jobs, other
+# users of create_app (flask shell) must leave them alone
+with app.app_context():
+    interrupt_jobs()
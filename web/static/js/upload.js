@@ -3,6 +3,21 @@ const $ = document.querySelector.bind(document);
 
 //APP
 let App = {};
+
+const sleep = ms => new Promise(resolve => setTimeout(resolve, ms));
+
+// poll job status until the background sync is over
+async function waitJob(job) {
+	while (true) {
+		let r = await fetch(`/jobs/${job}`);
+		let data = await r.json();
+		if (!r.ok || data["status"] === "done" || data["status"] === "failed") {
+			return data;
+		}
+		await sleep(1000);
+	}
+}
+
 App.init = (function () {
 	//Init
 	async function handleFileSelect(evt) {
@@ -38,9 +53,11 @@ App.init = (function () {
 				let r = await fetch('/upload', { method: "POST", body: formData });
 				console.log('HTTP response code:', r.status);
 				if (r.ok === true) {
+					data = await waitJob((await r.json())["job"]);
+				}
+				if (r.ok === true && data["status"] === "done") {
 					$(`.file--${file}`).querySelector(".progress").classList.remove("active");
 					$(`.file--${file}`).querySelector(".done").classList.add("anim");
-					data = await r.json();
 					$("#result").src = data["image"];
 					missing_ids = data["missing_ids"];
 					for (let i = 0; i < missing_ids.length; i++) {
@@ -57,7 +74,9 @@ App.init = (function () {
 					$("#missing").style.display="";
 				} else {
 					try {
-						data = await r.json();
+						if (r.ok !== true) {
+							data = await r.json();
+						}
 						$("#result").src = data["image"];
 					} catch (e) {
 						$("#result").src = "https://i.giphy.com/media/RJaUOmpBQAoE4RuWnj/source.gif";